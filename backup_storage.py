@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
-import global_env
-import consul
+import consul_pool
 import uuid
 import os
 import gzip
@@ -65,8 +64,7 @@ class BackupStorage(object):
 
     def register_backup(self, backup_id, archive_id, group_id, instance_type,
                         size, mem_used):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         creation_time = datetime.datetime.now(
@@ -87,8 +85,7 @@ class BackupStorage(object):
 
     def unregister_backup(self, backup_id, delete_task):
         try:
-            consul_obj = consul.Consul(host=global_env.consul_host,
-                                       token=global_env.consul_acl_token)
+            consul_obj = consul_pool.get_client()
             kv = consul_obj.kv
 
             delete_task.log("Unregistring backup '%s'", backup_id)
@@ -98,7 +95,7 @@ class BackupStorage(object):
 
             kv.delete('tarantool_backups/%s' % backup_id, recurse=True)
 
-            sense.Sense.update()
+            sense.Sense.refresh_backup(backup_id)
 
             archive_used = False
             for backup in sense.Sense.backups().values():
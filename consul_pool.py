@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import global_env
+import consul
+import consul.std
+import requests
+import time
+import collections
+
+# Blocking queries hold a connection each, so keep enough of them
+MAX_CONNECTIONS_PER_HOST = 20
+
+# host -> consul.Consul
+CLIENTS = {}
+STATS = collections.defaultdict(lambda: {'count': 0,
+                                         'errors': 0,
+                                         'total_time': 0.0,
+                                         'max_time': 0.0})
+
+
+def endpoint_name(method, path, params):
+    """
+    Groups requests by endpoint, e.g. 'GET /v1/kv' or
+    'GET /v1/health/service', leaving out keys and service names.
+    """
+    segments = path.strip('/').split('/')
+    if len(segments) > 1 and segments[1] == 'kv':
+        segments = segments[:2]
+    else:
+        segments = segments[:3]
+
+    name = method + ' /' + '/'.join(segments)
+
+    if any(param[0] == 'index' for param in (params or [])):
+        name += ' (blocking)'
+
+    return name
+
+
+class HTTPClient(consul.std.HTTPClient):
+    """
+    HTTP client of python-consul that records the latency of every
+    request by endpoint.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=MAX_CONNECTIONS_PER_HOST)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def timed(self, method, func, callback, path, params, *args):
+        stats = STATS[endpoint_name(method, path, params)]
+        start = time.time()
+
+        try:
+            return func(callback, path, params, *args)
+        except Exception:
+            stats['errors'] += 1
+            raise
+        finally:
+            elapsed = time.time() - start
+            stats['count'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def get(self, callback, path, params=None):
+        return self.timed('GET', super().get, callback, path, params)
+
+    def put(self, callback, path, params=None, data=''):
+        return self.timed('PUT', super().put, callback, path, params, data)
+
+    def delete(self, callback, path, params=None):
+        return self.timed('DELETE', super().delete, callback, path, params)
+
+    def post(self, callback, path, params=None, data=''):
+        return self.timed('POST', super().post, callback, path, params, data)
+
+
+class Consul(consul.Consul):
+    def connect(self, host, port, scheme, verify=True, cert=None):
+        return HTTPClient(host, port, scheme, verify, cert)
+
+
+def get_client(host=None):
+    """
+    Returns a consul client for 'host', or for the main consul host if
+    no host is given. Clients are shared by the whole process and keep
+    their HTTP connections alive.
+    """
+    host = host or global_env.consul_host
+
+    client = CLIENTS.get(host, None)
+    if client is None:
+        client = Consul(host=host, token=global_env.consul_acl_token)
+        CLIENTS[host] = client
+
+    return client
+
+
+def stats():
+    """
+    Returns request count, error count and latency per endpoint.
+    """
+    result = {}
+
+    for name, stats in STATS.items():
+        result[name] = dict(stats)
+        result[name]['avg_time'] = stats['total_time'] / stats['count'] \
+            if stats['count'] else 0.0
+
+    return result
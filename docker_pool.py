@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import global_env
+import docker
+import docker.utils.socket
+import requests
+import urllib3.connectionpool
+import collections
+import logging
+
+DEFAULT_TIMEOUT = 60 # seconds
+MAX_CONNECTIONS_PER_HOST = 10
+# how long a request waits for a free connection before it fails
+POOL_TIMEOUT = 30 # seconds
+
+# (addr, timeout) -> docker.Client
+CLIENTS = {}
+STATS = collections.Counter()
+
+
+class BoundedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout or POOL_TIMEOUT)
+
+
+class BoundedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    def _get_conn(self, timeout=None):
+        return super()._get_conn(timeout or POOL_TIMEOUT)
+
+
+BOUNDED_POOLS = {'http': BoundedHTTPConnectionPool,
+                 'https': BoundedHTTPSConnectionPool}
+
+
+def get_client(addr, timeout=DEFAULT_TIMEOUT):
+    """
+    Returns a docker client for the daemon at 'addr'. Clients are
+    shared by the whole process and keep their connections alive, so
+    requests to the same daemon skip the TCP connect and TLS handshake.
+    A client opens at most MAX_CONNECTIONS_PER_HOST connections. When
+    all of them are busy, callers wait for one, and fail with
+    urllib3's EmptyPoolError after POOL_TIMEOUT seconds, so a stream
+    that is never closed shows up as an error instead of a hang.
+
+    Raw streams, like the ones of get_archive(), hold their connection
+    until they are passed to close_stream(). Exec output must be read
+    with exec_output() or exec_stream(). Streams that never end, like
+    /events, hold their connection for good and must use a
+    docker.Client of their own.
+    """
+    key = (addr, timeout)
+
+    STATS['requests'] += 1
+    client = CLIENTS.get(key, None)
+    if client is not None:
+        STATS['reused'] += 1
+        return client
+
+    client = docker.Client(base_url=addr,
+                           tls=global_env.docker_tls_config,
+                           timeout=timeout)
+
+    for prefix in ('http://', 'https://'):
+        adapter = client.adapters.get(prefix, None)
+        if isinstance(adapter, requests.adapters.HTTPAdapter):
+            adapter.init_poolmanager(1, MAX_CONNECTIONS_PER_HOST, block=True)
+            adapter.poolmanager.pool_classes_by_scheme = BOUNDED_POOLS
+
+    STATS['created'] += 1
+    CLIENTS[key] = client
+    return client
+
+
+def close_stream(stream):
+    """
+    Closes a raw response, e.g. from get_archive(), or an exec stream,
+    whether or not it was read to the end, and gives its connection
+    back to the pool.
+    """
+    try:
+        stream.close()
+    except Exception:
+        pass
+
+    release_conn = getattr(stream, 'release_conn', None)
+    if release_conn is not None:
+        release_conn()
+
+
+def close_exec_socket(sock):
+    """
+    Closes the connection of an exec and gives its pool slot back. The
+    connection was upgraded to a raw stream, so it can't be reused, and
+    the next request opens a fresh one in its place.
+    """
+    # docker-py keeps the response on the socket, when it can
+    response = getattr(sock, '_response', None)
+
+    try:
+        sock.close()
+    except Exception:
+        pass
+
+    if response is not None:
+        close_stream(response.raw)
+
+
+class ExecStream(object):
+    """
+    Output of an exec that has been started, frame by frame. Must be
+    passed to close_stream() when done with.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.frames = docker.utils.socket.frames_iter(sock)
+
+    def __iter__(self):
+        return self.frames
+
+    def close(self):
+        close_exec_socket(self.sock)
+
+
+def exec_stream(docker_obj, exec_id):
+    """
+    Starts an exec, like exec_start(exec_id, stream=True).
+    """
+    return ExecStream(docker_obj.exec_start(exec_id, socket=True))
+
+
+def exec_output(docker_obj, exec_id):
+    """
+    Starts an exec and returns all of its output, like
+    exec_start(exec_id), but closes its connection afterwards.
+    """
+    stream = exec_stream(docker_obj, exec_id)
+    try:
+        return b''.join(stream)
+    finally:
+        close_stream(stream)
+
+
+def evict(addr):
+    """
+    Drops and closes all clients of 'addr', e.g. when the host goes
+    critical and its connections are likely dead.
+    """
+    for key in [key for key in CLIENTS if key[0] == addr]:
+        client = CLIENTS.pop(key)
+        STATS['evicted'] += 1
+        logging.info("Closing docker connections to %s", addr)
+
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def stats():
+    """
+    Returns client cache counters, plus the number of connections
+    opened and requests sent per daemon. The closer 'connections' is
+    to 1 relative to 'requests', the better connections are reused.
+    """
+    hosts = {}
+
+    for (addr, _), client in CLIENTS.items():
+        host = hosts.setdefault(addr, {'clients': 0,
+                                       'connections': 0,
+                                       'requests': 0})
+        host['clients'] += 1
+
+        for adapter in client.adapters.values():
+            poolmanager = getattr(adapter, 'poolmanager', None)
+            if poolmanager is None:
+                continue
+
+            for pool_key in poolmanager.pools.keys():
+                pool = poolmanager.pools[pool_key]
+                host['connections'] += pool.num_connections
+                host['requests'] += pool.num_requests
+
+    return {'clients': dict(STATS), 'hosts': hosts}
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+import collections
+import datetime
+import itertools
+import logging
+import time
+import gevent
+import gevent.event
+import sense
+
+# events kept in memory for clients that reconnect with an index
+EVENT_LOG_SIZE = 10000
+
+STATE_WAIT_TIMEOUT = 60 # seconds
+STATE_RETRY_INTERVAL = 10 # seconds
+
+EVENT_TYPES = ('group', 'instance', 'container', 'task')
+
+
+class EventLog(object):
+    """
+    Bounded log of change events. Every event gets an index one greater
+    than the previous one, so clients can resume from the last index
+    they have seen as long as it is still in the log.
+    """
+    def __init__(self, size=EVENT_LOG_SIZE):
+        self.events = collections.deque(maxlen=size)
+        self.index = 0
+        self.appended = gevent.event.Event()
+
+    def append(self, event_type, group_id, **fields):
+        self.index += 1
+
+        event = {'index': self.index,
+                 'type': event_type,
+                 'group_id': group_id,
+                 'timestamp': datetime.datetime.now(
+                     datetime.timezone.utc).isoformat()}
+        event.update(fields)
+        self.events.append(event)
+
+        appended, self.appended = self.appended, gevent.event.Event()
+        appended.set()
+
+    def first_index(self):
+        if not self.events:
+            return self.index + 1
+        return self.events[0]['index']
+
+    def since(self, index):
+        """
+        Returns the events that came after 'index'. Events that were
+        already pushed out of the log are skipped, which callers can
+        tell by comparing 'index' with first_index().
+        """
+        if index >= self.index:
+            return []
+
+        start = max(index + 1 - self.first_index(), 0)
+        return list(itertools.islice(self.events, start, None))
+
+    def wait(self, index, timeout):
+        """
+        Blocks until there are events after 'index' or until 'timeout'
+        seconds pass. Returns the index of the last event.
+        """
+        deadline = time.time() + timeout
+
+        while self.index <= index:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            self.appended.wait(remaining)
+
+        return self.index
+
+
+LOG = EventLog()
+
+
+def matches(event, group_id=None, types=None):
+    if group_id is not None and event['group_id'] != group_id:
+        return False
+    if types and event['type'] not in types:
+        return False
+    return True
+
+
+def diff_groups(old, new):
+    """
+    Yields group and instance events between two States.
+    """
+    old_health = old.group_health()
+    new_health = new.group_health()
+
+    for group_id in old_health.keys() - new_health.keys():
+        yield 'group', group_id, {'action': 'deleted',
+                                  'old_state': old_health[group_id]['status'],
+                                  'state': None}
+
+    for group_id, health in new_health.items():
+        old_group = old_health.get(group_id, None)
+
+        if old_group is None:
+            yield 'group', group_id, {'action': 'created',
+                                      'old_state': None,
+                                      'state': health['status']}
+            old_instances = {}
+        else:
+            if old_group['status'] != health['status']:
+                yield 'group', group_id, {'action': 'state_changed',
+                                          'old_state': old_group['status'],
+                                          'state': health['status']}
+            old_instances = old_group['instances']
+
+        for instance_num, status in health['instances'].items():
+            old_status = old_instances.get(instance_num, None)
+            if old_status != status:
+                yield 'instance', group_id, {
+                    'instance_id': group_id + '_' + instance_num,
+                    'old_state': old_status,
+                    'state': status}
+
+
+def container_action(old, new):
+    if old is None:
+        return 'created'
+    if new is None:
+        return 'removed'
+    if old['is_running'] != new['is_running']:
+        return 'started' if new['is_running'] else 'stopped'
+    if old['host'] != new['host'] or \
+       old['docker_image_id'] != new['docker_image_id']:
+        return 'updated'
+    return None
+
+
+def diff_containers(old, new):
+    """
+    Yields container lifecycle events between two States.
+    """
+    old_groups = old.containers()
+    new_groups = new.containers()
+    empty = {'instances': {}}
+
+    for group_id in old_groups.keys() | new_groups.keys():
+        old_instances = old_groups.get(group_id, empty)['instances']
+        new_instances = new_groups.get(group_id, empty)['instances']
+
+        for instance_num in old_instances.keys() | new_instances.keys():
+            old_container = old_instances.get(instance_num, None)
+            container = new_instances.get(instance_num, None)
+
+            action = container_action(old_container, container)
+            if action is None:
+                continue
+
+            current = container or old_container
+            yield 'container', group_id, {
+                'instance_id': group_id + '_' + instance_num,
+                'action': action,
+                'host': current['host'],
+                'is_running': container['is_running'] if container else False,
+                'docker_image_name': current['docker_image_name'],
+                'docker_image_id': current['docker_image_id']}
+
+
+def diff_states(old, new):
+    """
+    Yields (type, group id, fields) of every change between two States.
+    Parts are replaced as a whole when they change, so the ones that
+    are the same objects in both States are not compared.
+    """
+    if old.snapshot is not new.snapshot or \
+       old.service_entries is not new.service_entries:
+        yield from diff_groups(old, new)
+
+    if old.container_entries is not new.container_entries:
+        yield from diff_containers(old, new)
+
+
+def watch_states():
+    """
+    Turns every new generation of the Sense state into events. The
+    state at startup is the baseline and produces no events.
+    """
+    previous = sense.Sense.state()
+
+    while True:
+        try:
+            sense.Sense.wait_for_generation(previous.generation,
+                                            STATE_WAIT_TIMEOUT)
+            current = sense.Sense.state()
+            if current.generation == previous.generation:
+                continue
+
+            for event_type, group_id, fields in diff_states(previous,
+                                                            current):
+                LOG.append(event_type, group_id,
+                           generation=current.generation, **fields)
+
+            previous = current
+        except Exception:
+            logging.exception("Failed to compute state events")
+            time.sleep(STATE_RETRY_INTERVAL)
+
+
+def task_changed(task):
+    """
+    Records progress of a task. The last log line is attached only if
+    the change was that line being added.
+    """
+    message = None
+    last = task.logs.last()
+    if last is not None and last['index'] == task.index:
+        message = last['message']
+
+    LOG.append('task', getattr(task, 'group_id', None),
+               task_id=task.task_id,
+               task_type=task.task_type,
+               status=task.status,
+               progress=task.progress,
+               message=task.message,
+               log=message)
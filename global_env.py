@@ -7,11 +7,30 @@ backup_storage = None
 kv = []
 settings = []
 backups = {}
+snapshot = None
+# bumped by Sense.publish() whenever any of the state changes
+generation = 0
+# parts of the state that were loaded from snapshot_file and haven't
+# been refreshed yet
+stale_parts = set()
+snapshot_file = None
+# service name -> [sense.ServiceEntry]
 services = {}
 nodes = {}
+# consul host -> [sense.ContainerEntry]
 containers = {}
+# consul host -> sense.DockerInfo
 docker_info = {}
 docker_statuses = {}
+docker_poll_concurrency = 20
+# completed tasks are kept up to this many and for this long, in seconds
+task_retention_count = 1000
+task_retention_age = 86400
+# log entries kept of every running and completed task
+task_log_size = 1000
+task_completed_log_size = 100
+# directory of the task journal, tasks are not persisted if it is None
+task_journal_dir = None
 default_network_settings = {"network_name": None,
                             "gateway_ip": None,
                             "subnet": None,
@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
-import consul
-import global_env
+import consul_pool
 from sense import Sense
 
 class GroupNotFoundError(RuntimeError):
@@ -10,38 +9,49 @@ class GroupNotFoundError(RuntimeError):
 class Group(object):
     def __init__(self, consul_host, group_id):
         self.consul_host = consul_host
-        self.consul = consul.Consul(host=consul_host,
-                                    token=global_env.consul_acl_token)
+        self.consul = consul_pool.get_client(consul_host)
         self.group_id = group_id
 
-        blueprints = Sense.blueprints()
+        # All properties are read from this state, so that a task sees
+        # the same cluster all the way through until it calls refresh()
+        self.state = Sense.state()
 
-        if not group_id in blueprints:
+        blueprint = self.state.blueprint(group_id)
+
+        if blueprint is None:
             raise GroupNotFoundError("No such blueprint: '%s'", group_id)
 
-        self._blueprint = blueprints[group_id]
+        self._blueprint = blueprint
+
+    def refresh(self):
+        """
+        Re-reads the group from Consul and docker, and switches to the
+        state that includes the changes.
+        """
+        Sense.refresh_group(self.group_id)
+        self.state = Sense.state()
 
     @property
     def blueprint(self):
-        blueprints = Sense.blueprints()
+        blueprint = self.state.blueprint(self.group_id)
 
-        if self.group_id in blueprints:
-            self._blueprint = blueprints[self.group_id]
+        if blueprint is not None:
+            self._blueprint = blueprint
 
         return self._blueprint
 
     @property
     def allocation(self):
-        allocations = Sense.allocations()
+        allocation = self.state.allocation(self.group_id)
 
-        if self.group_id in allocations:
-            return allocations[self.group_id]
+        if allocation is not None:
+            return allocation
         else:
             return {"instances": {}}
 
     @property
     def services(self):
-        services = Sense.services()
+        services = self.state.services()
 
         if self.group_id in services:
             return services[self.group_id]
@@ -50,7 +60,7 @@ class Group(object):
 
     @property
     def containers(self):
-        containers = Sense.containers()
+        containers = self.state.containers()
 
         if self.group_id in containers:
             return containers[self.group_id]
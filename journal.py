@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import json
+import time
+import logging
+import gevent
+import gevent.queue
+import task
+
+# a new segment is started when the current one grows past this size
+JOURNAL_SEGMENT_SIZE = 4 * 1024 ** 2 # bytes
+# when there are more segments than this, they are compacted into one
+JOURNAL_MAX_SEGMENTS = 4
+
+SEGMENT_NAME = re.compile(r'^tasks-(\d+)\.log$')
+
+# fields of Task.get_dict() that are not specific to a kind of task
+BASE_FIELDS = ('id', 'type', 'status', 'message', 'index', 'progress',
+               'creation_time')
+
+
+class RestoredTask(task.Task):
+    """
+    Task read back from the journal. Fields that the original task
+    class added to get_dict(), like 'group_id', are kept in 'extra'.
+    """
+    def __init__(self, task_id, task_type, extra):
+        super().__init__(task_type)
+        self.task_id = task_id
+        self.extra = extra
+        for name, value in extra.items():
+            setattr(self, name, value)
+
+    def get_dict(self, index=None):
+        obj = super().get_dict(index)
+        obj.update(self.extra)
+        return obj
+
+
+def extra_fields(task_obj):
+    obj = task_obj.summary()
+    return {k: v for k, v in obj.items() if k not in BASE_FIELDS}
+
+
+def task_records(task_obj):
+    """
+    Records that recreate the task as it is now.
+    """
+    records = [{'op': 'create',
+                'id': task_obj.task_id,
+                'type': task_obj.task_type,
+                'time': task_obj.creation_time,
+                'extra': extra_fields(task_obj),
+                'dropped_logs': task_obj.logs.dropped,
+                'dropped_index': task_obj.logs.dropped_index}]
+
+    for entry in task_obj.logs:
+        records.append({'op': 'log', 'id': task_obj.task_id, 'entry': entry})
+
+    if task_obj.status != task.STATUS_RUNNING or task_obj.message:
+        records.append(status_record(task_obj))
+
+    return records
+
+
+def status_record(task_obj):
+    return {'op': 'status',
+            'id': task_obj.task_id,
+            'status': task_obj.status,
+            'message': task_obj.message,
+            'index': task_obj.index,
+            'time': task_obj.completion_time}
+
+
+def apply_record(tasks, record):
+    task_id = record['id']
+
+    if record['op'] == 'create':
+        task_obj = RestoredTask(task_id, record['type'], record['extra'])
+        task_obj.creation_time = record['time']
+        task_obj.logs.dropped = record.get('dropped_logs', 0)
+        task_obj.logs.dropped_index = record.get('dropped_index', 0)
+        tasks[task_id] = task_obj
+        return
+
+    task_obj = tasks.get(task_id, None)
+    if task_obj is None:
+        return
+
+    if record['op'] == 'log':
+        entry = record['entry']
+        task_obj.logs.append(entry)
+        task_obj.index = max(task_obj.index, entry['index'])
+        task_obj.progress = entry['progress']
+    elif record['op'] == 'status':
+        task_obj.status = record['status']
+        task_obj.message = record['message']
+        task_obj.index = max(task_obj.index, record['index'])
+        task_obj.completion_time = record['time']
+    elif record['op'] == 'remove':
+        del tasks[task_id]
+
+
+class Journal(object):
+    """
+    Append-only record of the tasks of a TaskStore, kept as numbered
+    segment files in a directory. Records are JSON lines. When there
+    are too many segments, the current contents of the store are
+    written to a new segment and the older ones are deleted.
+
+    Changes are queued and written by a single greenlet, with the file
+    operations in a thread, so tasks never wait for the disk.
+    """
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store
+        self.fobj = None
+        # (records, whether to fsync them) waiting to be written
+        self.queue = gevent.queue.Queue()
+        self.writer = None
+
+        os.makedirs(path, exist_ok=True)
+
+        self.segments = []
+        for name in os.listdir(path):
+            match = SEGMENT_NAME.match(name)
+            if match:
+                self.segments.append(int(match.group(1)))
+        self.segments.sort()
+
+    def segment_path(self, seq):
+        return os.path.join(self.path, 'tasks-%08d.log' % seq)
+
+    def replay(self):
+        """
+        Reads all segments and returns the tasks they describe, in the
+        order of creation.
+        """
+        tasks = {}
+
+        for seq in self.segments:
+            with open(self.segment_path(seq)) as fobj:
+                for line in fobj:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # the last write before a crash may be partial
+                        logging.warning("Skipping damaged record in %s",
+                                        self.segment_path(seq))
+                        continue
+                    apply_record(tasks, record)
+
+        return sorted(tasks.values(), key=lambda t: t.creation_time)
+
+    def start(self):
+        self.writer = gevent.spawn(self.run)
+
+    def run(self):
+        """
+        Writes whatever is queued in one go, then waits for more.
+        """
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            try:
+                data = ''.join(json.dumps(record) + '\n'
+                               for records, _ in batch
+                               for record in records)
+                sync = any(sync for _, sync in batch)
+                gevent.get_hub().threadpool.apply(self.write, (data, sync))
+
+                if len(self.segments) > JOURNAL_MAX_SEGMENTS:
+                    self.compact()
+            except Exception:
+                logging.exception("Failed to write task journal to %s",
+                                  self.path)
+
+    def append(self, records, sync=False):
+        self.queue.put((records, sync))
+
+    def write(self, data, sync):
+        if self.fobj is None or self.fobj.tell() >= JOURNAL_SEGMENT_SIZE:
+            self.rotate()
+
+        self.fobj.write(data)
+        self.fobj.flush()
+        if sync:
+            os.fsync(self.fobj.fileno())
+
+    def rotate(self):
+        if self.fobj is not None:
+            self.fobj.close()
+
+        seq = self.segments[-1] + 1 if self.segments else 1
+        self.segments.append(seq)
+        self.fobj = open(self.segment_path(seq), 'a')
+
+    def compact(self):
+        """
+        Replaces all segments with one that has the current tasks.
+        Records still in the queue describe changes the tasks already
+        have, so they are dropped.
+        """
+        start = time.time()
+
+        records = []
+        for task_obj in self.store.tasks.values():
+            records.extend(task_records(task_obj))
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+        data = ''.join(json.dumps(record) + '\n' for record in records)
+        gevent.get_hub().threadpool.apply(self.replace_segments, (data,))
+
+        logging.info("Compacted task journal in %.3f seconds",
+                     time.time() - start)
+
+    def replace_segments(self, data):
+        seq = self.segments[-1] + 1 if self.segments else 1
+        path = self.segment_path(seq)
+        tmp_path = path + '.tmp'
+
+        with open(tmp_path, 'w') as fobj:
+            fobj.write(data)
+            fobj.flush()
+            os.fsync(fobj.fileno())
+
+        os.replace(tmp_path, path)
+
+        if self.fobj is not None:
+            self.fobj.close()
+
+        for old_seq in self.segments:
+            os.unlink(self.segment_path(old_seq))
+
+        self.segments = [seq]
+        self.fobj = open(path, 'a')
+
+    def task_added(self, task_obj):
+        self.append(task_records(task_obj))
+
+    def task_logged(self, task_obj, entry):
+        self.append([{'op': 'log', 'id': task_obj.task_id, 'entry': entry}])
+
+    def task_status_changed(self, task_obj):
+        self.append([status_record(task_obj)], sync=True)
+
+    def task_removed(self, task_obj):
+        self.append([{'op': 'remove', 'id': task_obj.task_id}])
+
+
+def interrupt(task_obj):
+    """
+    Marks a task that was running when the server stopped as failed,
+    remembering the last step it logged.
+    """
+    last = task_obj.logs.last()
+    last_step = last['message'] if last is not None else None
+
+    task_obj.extra['interrupted'] = True
+    task_obj.extra['last_step'] = last_step
+    task_obj.interrupted = True
+    task_obj.last_step = last_step
+
+    if last_step is None:
+        message = "Interrupted by a restart before the first step"
+    else:
+        message = "Interrupted by a restart after: %s" % last_step
+
+    task_obj.log(message)
+    task_obj.set_status(task.STATUS_CRITICAL, message)
+
+
+def open_journal(path, store):
+    """
+    Restores the tasks recorded in the journal at 'path' into 'store',
+    and records all further changes of the store there.
+    """
+    journal = Journal(path, store)
+
+    interrupted = 0
+    for task_obj in journal.replay():
+        if task_obj.status == task.STATUS_RUNNING:
+            interrupt(task_obj)
+            interrupted += 1
+        store.add(task_obj)
+
+    logging.info("Restored %d tasks from %s, %d of them interrupted",
+                 len(store.tasks), path, interrupted)
+
+    # Start from a single segment with the restored tasks, which also
+    # records the interrupted ones
+    journal.compact()
+    store.journal = journal
+    journal.start()
+
+    return journal
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import bisect
+import collections
+import datetime
+
+
+def as_utc(value):
+    """
+    Times without a timezone are taken to be in UTC, so that they can be
+    compared with the ones that have it.
+    """
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=datetime.timezone.utc)
+    return value
+
+
+class Catalog(object):
+    """
+    Entries of a listing keyed by id, indexed for filtering and paging.
+
+    'exact' maps a filter name to a function that returns the values an
+    entry id can be found by. 'ordered' maps a filter name to a function
+    that returns a sortable value of an entry id, or None; these support
+    prefix and lower bound queries.
+
+    Pages are in the order of ids, and the cursor is the last id of the
+    previous page, so paging is stable while entries come and go.
+    """
+    def __init__(self, entries, exact=None, ordered=None):
+        self.entries = entries
+        self.ids = sorted(entries)
+        self.exact_funcs = exact or {}
+        self.ordered_funcs = ordered or {}
+
+        # filter name -> value -> sorted list of ids
+        self.exact = {}
+        for name, func in self.exact_funcs.items():
+            index = collections.defaultdict(list)
+            for entry_id in self.ids:
+                for value in set(func(entry_id)):
+                    index[value].append(entry_id)
+            self.exact[name] = dict(index)
+
+        # filter name -> ([sorted values], [ids in the same order])
+        self.ordered = {}
+        for name, func in self.ordered_funcs.items():
+            pairs = []
+            for entry_id in self.ids:
+                value = func(entry_id)
+                if value is not None:
+                    pairs.append((value, entry_id))
+            pairs.sort()
+            self.ordered[name] = ([p[0] for p in pairs],
+                                  [p[1] for p in pairs])
+
+    def entry(self, entry_id):
+        return self.entries[entry_id]
+
+    def query(self, exact=None, prefix=None, after=None,
+              cursor=None, limit=None):
+        """
+        Returns ids of the entries that match all of the filters, and
+        the cursor of the next page or None if this is the last one.
+
+        'exact' maps filter names to the value to look for, 'prefix'
+        maps ordered filter names to a string prefix, and 'after' maps
+        ordered filter names to an exclusive lower bound. The smallest
+        of the index ranges is walked and the rest of the filters are
+        checked on its entries only.
+        """
+        ranges = []
+        checks = []
+
+        for name, value in (exact or {}).items():
+            ranges.append((self.exact[name].get(value, []), True))
+            checks.append(lambda i, f=self.exact_funcs[name], v=value:
+                          v in f(i))
+
+        for name, value in (prefix or {}).items():
+            values, ids = self.ordered[name]
+            start = bisect.bisect_left(values, value)
+            end = len(values)
+            if value:
+                end = bisect.bisect_left(values,
+                                         value[:-1] + chr(ord(value[-1]) + 1))
+            ranges.append((ids[start:end], False))
+            checks.append(lambda i, f=self.ordered_funcs[name], v=value:
+                          (f(i) or '').startswith(v))
+
+        for name, value in (after or {}).items():
+            values, ids = self.ordered[name]
+            start = bisect.bisect_right(values, value)
+            ranges.append((ids[start:], False))
+            checks.append(lambda i, f=self.ordered_funcs[name], v=value:
+                          f(i) is not None and f(i) > v)
+
+        if ranges:
+            ids, is_sorted = min(ranges, key=lambda r: len(r[0]))
+            if not is_sorted:
+                ids = sorted(ids)
+        else:
+            ids = self.ids
+
+        start = 0
+        if cursor is not None:
+            start = bisect.bisect_right(ids, cursor)
+
+        result = []
+        for pos in range(start, len(ids)):
+            entry_id = ids[pos]
+            if not all(check(entry_id) for check in checks):
+                continue
+
+            if limit is not None and len(result) == limit:
+                return result, result[-1]
+
+            result.append(entry_id)
+
+        return result, None
+
+
+def project(entry, fields):
+    """
+    Leaves only 'fields' of an entry, or all of them if 'fields' is
+    empty.
+    """
+    if not fields:
+        return entry
+    return {field: entry[field] for field in fields if field in entry}
@@ -3,12 +3,13 @@
 import os
 import global_env
 import group
-import consul
+import consul_pool
 from sense import Sense
 import ip_pool
 import random
 import logging
 import docker
+import docker_pool
 import uuid
 import time
 import tarantool
@@ -79,8 +80,7 @@ class Memcached(group.Group):
         group_id = create_task.group_id
 
         try:
-            consul_obj = consul.Consul(host=global_env.consul_host,
-                                       token=global_env.consul_acl_token)
+            consul_obj = consul_pool.get_client()
             kv = consul_obj.kv
 
             create_task.log("Creating group '%s'", group_id)
@@ -93,26 +93,27 @@ class Memcached(group.Group):
             kv.put('tarantool/%s/blueprint/name' % group_id, name.encode('utf-8'))
             kv.put('tarantool/%s/blueprint/memsize' % group_id, str(memsize))
             kv.put('tarantool/%s/blueprint/check_period' % group_id, str(check_period))
-            kv.put('tarantool/%s/blueprint/creation_time' % group_id, creation_time)
             kv.put('tarantool/%s/blueprint/instances/1/addr' % group_id, ip1)
             kv.put('tarantool/%s/blueprint/instances/2/addr' % group_id, ip2)
+            # The group becomes visible with this key, so it goes last
+            kv.put('tarantool/%s/blueprint/creation_time' % group_id, creation_time)
 
-            Sense.update()
+            Sense.refresh_group(group_id)
 
             memc = Memcached(global_env.consul_host, group_id)
 
             create_task.log("Allocating instance to physical nodes")
 
             memc.allocate()
-            Sense.update()
+            memc.refresh()
 
             create_task.log("Registering services")
             memc.register()
-            Sense.update()
+            memc.refresh()
 
             create_task.log("Creating containers")
             memc.create_containers(password)
-            Sense.update()
+            memc.refresh()
 
             create_task.log("Enabling replication")
             memc.wait_for_instances(create_task)
@@ -147,7 +148,7 @@ class Memcached(group.Group):
 
             delete_task.log("Completed removing group")
 
-            Sense.update()
+            self.refresh()
             delete_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to delete group '%s'", group_id)
@@ -167,7 +168,7 @@ class Memcached(group.Group):
 
             upgrade_task.log("Completed upgrading containers")
 
-            Sense.update()
+            self.refresh()
             upgrade_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to upgrade group '%s'", group_id)
@@ -196,7 +197,7 @@ class Memcached(group.Group):
             if backup_id:
                 self.restore(backup_id, storage, update_task)
 
-            Sense.update()
+            self.refresh()
             update_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to update group '%s'", self.group_id)
@@ -244,8 +245,7 @@ class Memcached(group.Group):
 
 
     def rename(self, name, update_task):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         msg = "Renaming group '%s' to '%s'" % (self.group_id, name)
@@ -255,8 +255,7 @@ class Memcached(group.Group):
         kv.put('tarantool/%s/blueprint/name' % self.group_id, name)
 
     def resize(self, memsize, update_task):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         update_task.log("Resizing instance 1")
@@ -274,8 +273,7 @@ class Memcached(group.Group):
         self.set_instance_password("2", password)
 
     def allocate(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         blueprint = self.blueprint
@@ -289,8 +287,7 @@ class Memcached(group.Group):
                self.group_id, host2)
 
     def unallocate(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         logging.info("Unallocating '%s'", self.group_id)
@@ -319,24 +316,19 @@ class Memcached(group.Group):
             allocation = self.allocation
             instance_id = self.group_id + '_' + instance_num
             docker_host = allocation['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
 
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = 'ls /var/lib/tarantool'
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                          cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -373,7 +365,7 @@ class Memcached(group.Group):
             cmd = "mkdir '%s'" % tmp_backup_dir
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -386,7 +378,7 @@ class Memcached(group.Group):
                     file_to_backup, tmp_backup_dir, file_to_backup)
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -394,12 +386,15 @@ class Memcached(group.Group):
                         "Failed to hardlink backup file: " + out.decode('utf-8'))
 
             strm, _ = docker_obj.get_archive(instance_id, tmp_backup_dir+'/.')
-            archive_id, size = storage.put_archive(strm)
+            try:
+                archive_id, size = storage.put_archive(strm)
+            finally:
+                docker_pool.close_stream(strm)
 
             cmd = "rm -rf /var/lib/tarantool/backup-*"
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -411,7 +406,7 @@ class Memcached(group.Group):
             storage.register_backup(backup_id, archive_id, group_id,
                                     'memcached', size, mem_used)
 
-            Sense.update()
+            Sense.refresh_backup(backup_id)
 
             backup_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
@@ -425,7 +420,7 @@ class Memcached(group.Group):
 
         restore_task.log("Restoring group '%s'", group_id)
 
-        backup = Sense.backups()[backup_id]
+        backup = self.state.backups()[backup_id]
         archive_id = backup['archive_id']
         mem_used = backup['mem_used']
 
@@ -434,21 +429,16 @@ class Memcached(group.Group):
                 allocation = self.allocation
                 instance_id = self.group_id + '_' + instance_num
                 docker_host = allocation['instances'][instance_num]['host']
-                docker_hosts = Sense.docker_hosts()
 
                 restore_task.log("Restoring instance: '%s'", instance_id)
 
-                docker_addr = None
-                for host in docker_hosts:
-                    if host['addr'].split(':')[0] == docker_host or \
-                       host['consul_host'] == docker_host:
-                        docker_addr = host['addr']
+                host = self.state.resolve_docker_host(docker_host)
+                docker_addr = host['addr'] if host else None
 
                 if not docker_addr:
                     raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
-                docker_obj = docker.Client(base_url=docker_addr,
-                                           tls=global_env.docker_tls_config)
+                docker_obj = docker_pool.get_client(docker_addr)
 
                 if mem_used > blueprint['memsize']:
                     err = ("Backed up instance used {} MiB of RAM, but " +
@@ -462,7 +452,7 @@ class Memcached(group.Group):
                 cmd = "mkdir '%s'" % tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -477,7 +467,7 @@ class Memcached(group.Group):
                 cmd = "sh -c 'rm -rf /var/lib/tarantool/*.snap'"
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -488,7 +478,7 @@ class Memcached(group.Group):
                 cmd = "sh -c 'rm -rf /var/lib/tarantool/*.xlog'"
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -499,7 +489,7 @@ class Memcached(group.Group):
                 cmd = "sh -c 'mv %s/* /var/lib/tarantool'" % tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -510,7 +500,7 @@ class Memcached(group.Group):
                 cmd = "rm -rf '%s'" % tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -539,8 +529,7 @@ class Memcached(group.Group):
         self.remove_container("2")
 
     def remove_blueprint(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         logging.info("Removing blueprint '%s'", self.group_id)
@@ -562,30 +551,28 @@ class Memcached(group.Group):
             other_addrs = [blueprint['instances'][i]['addr']
                            for i in other_instances]
             docker_host = allocation['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
             instance_id = self.group_id + '_' + instance_num
 
             wait_task.log("Waiting for '%s' to go up. It may take time to " +
                           "load data from disk.", instance_id)
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_is_up"
             attempts = 0
             while True:
                 exec_id = docker_obj.exec_create(instance_id,
                                                  cmd)
-                stream = docker_obj.exec_start(exec_id, stream=True)
+                stream = docker_pool.exec_stream(docker_obj, exec_id)
 
-                for line in stream:
-                    logging.info("Exec: %s", str(line))
+                try:
+                    for line in stream:
+                        logging.info("Exec: %s", str(line))
+                finally:
+                    docker_pool.close_stream(stream)
 
                 ret = docker_obj.exec_inspect(exec_id)
 
@@ -613,20 +600,15 @@ class Memcached(group.Group):
             other_addrs = [blueprint['instances'][i]['addr']
                            for i in other_instances]
             docker_host = allocation['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
             logging.info("Enabling replication between '%s' and '%s'",
                          addr, str(other_addrs))
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
 
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_set_config.lua TARANTOOL_REPLICATION_SOURCE " + \
                   ",".join(other_addrs)
@@ -635,10 +617,13 @@ class Memcached(group.Group):
             while attempts < 5:
                 exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                                  cmd)
-                stream = docker_obj.exec_start(exec_id, stream=True)
+                stream = docker_pool.exec_stream(docker_obj, exec_id)
 
-                for line in stream:
-                    logging.info("Exec: %s", str(line))
+                try:
+                    for line in stream:
+                        logging.info("Exec: %s", str(line))
+                finally:
+                    docker_pool.close_stream(stream)
 
                 ret = docker_obj.exec_inspect(exec_id)
 
@@ -659,20 +644,15 @@ class Memcached(group.Group):
 
         instance_id = self.group_id + '_' + instance_num
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
-        consul_host = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                consul_host = host['consul_host']
+        host = self.state.resolve_docker_host(docker_host)
+        consul_host = host['consul_host'] if host else None
         if not consul_host:
             raise RuntimeError("Failed to find consul host of %s" % docker_host)
 
         addr = blueprint['instances'][instance_num]['addr']
         check_period = blueprint['check_period']
 
-        consul_obj = consul.Consul(host=consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client(consul_host)
 
         replication_check = {
             'docker_container_id': instance_id,
@@ -713,25 +693,20 @@ class Memcached(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         try:
             docker_obj.disconnect_container_from_network(instance_id,
@@ -750,22 +725,17 @@ class Memcached(group.Group):
         instance_id = self.group_id + '_' + instance_num
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
-        consul_host = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                consul_host = host['consul_host']
+        host = self.state.resolve_docker_host(docker_host)
+        consul_host = host['consul_host'] if host else None
         if not consul_host:
             raise RuntimeError("Failed to find consul host of %s" % docker_host)
 
-        consul_hosts = [h['addr'].split(':')[0] for h in Sense.consul_hosts()
+        consul_hosts = [h['addr'].split(':')[0] for h in self.state.consul_hosts()
                         if h['status'] == 'passing']
 
         if services:
             if consul_host in consul_hosts:
-                consul_obj = consul.Consul(host=consul_host,
-                                           token=global_env.consul_acl_token)
+                consul_obj = consul_pool.get_client(consul_host)
 
                 check_id = instance_id + '_memory'
                 logging.info("Unregistering check '%s'", check_id)
@@ -792,19 +762,15 @@ class Memcached(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
@@ -813,8 +779,7 @@ class Memcached(group.Group):
         if other_instance_num is not None:
             replica_ip = blueprint['instances'][other_instance_num]['addr']
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         self.ensure_image(docker_addr)
         self.ensure_network(docker_addr)
@@ -888,19 +853,15 @@ class Memcached(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
@@ -909,8 +870,7 @@ class Memcached(group.Group):
         if instance_num == '2':
             replica_ip = blueprint['instances']['1']['addr']
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         self.ensure_image(docker_addr)
         self.ensure_network(docker_addr)
@@ -986,18 +946,12 @@ class Memcached(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1005,8 +959,7 @@ class Memcached(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
             docker_obj.stop(container=instance_id)
             docker_obj.remove_container(container=instance_id)
         else:
@@ -1020,18 +973,12 @@ class Memcached(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1040,15 +987,14 @@ class Memcached(group.Group):
                          memsize,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_set_config.lua TARANTOOL_SLAB_ALLOC_ARENA " + \
                   str(float(memsize)/1024)
 
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1067,18 +1013,12 @@ class Memcached(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1086,14 +1026,13 @@ class Memcached(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "memcached_set_password.lua " + password
 
             exec_id = docker_obj.exec_create(self.group_id + '_' +
                                              instance_num, cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1111,18 +1050,12 @@ class Memcached(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1130,13 +1063,15 @@ class Memcached(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             try:
                 strm, stat = docker_obj.get_archive(instance_id, '/opt/tarantool/auth.sasldb')
                 bio = io.BytesIO()
-                shutil.copyfileobj(strm, bio)
+                try:
+                    shutil.copyfileobj(strm, bio)
+                finally:
+                    docker_pool.close_stream(strm)
                 bio.seek(0)
                 tar = tarfile.open(fileobj=bio)
 
@@ -1151,8 +1086,7 @@ class Memcached(group.Group):
 
     @classmethod
     def ensure_image(cls, docker_addr, force=False):
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
         image_exists = any(['tarantool-cloud-memcached:latest' in (i['RepoTags'] or [])
                             for i in docker_obj.images()])
 
@@ -1181,10 +1115,9 @@ class Memcached(group.Group):
                                  decoded_line['stream'])
 
     def ensure_network(self, docker_addr):
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
-        settings = Sense.network_settings()
+        settings = self.state.network_settings()
         network_name = settings['network_name']
         subnet = settings['subnet']
 
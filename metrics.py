@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+import time
+import bisect
+import contextlib
+
+# upper bounds of latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                   5.0, 10.0, 30.0, 60.0, 300.0)
+
+# source name -> SourceStats
+SOURCES = {}
+
+
+class SourceStats(object):
+    """
+    Refresh statistics of one data source, e.g. a KV prefix watched in
+    Consul or a docker host. 'items' is the number of entries in the
+    last response.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.last_duration = None
+        self.last_items = None
+        self.last_success = None
+        self.last_error = None
+        self.last_error_time = None
+        # answers to blocking queries, which are not timed
+        self.contacts = 0
+        # while a blocking query is waiting, the time it was sent and
+        # how long it may wait for a change
+        self.parked_since = None
+        self.max_wait = None
+
+    def observe(self, duration, items=None, error=None):
+        self.count += 1
+        self.total_time += duration
+        self.last_duration = duration
+
+        pos = bisect.bisect_left(LATENCY_BUCKETS, duration)
+        if pos < len(self.buckets):
+            self.buckets[pos] += 1
+
+        if error is None:
+            self.last_success = time.time()
+            self.last_items = items
+        else:
+            self.errors += 1
+            self.last_error = error
+            self.last_error_time = time.time()
+
+    def contact(self, items=None, error=None):
+        self.parked_since = None
+
+        if error is None:
+            self.contacts += 1
+            self.last_success = time.time()
+            self.last_items = items
+        else:
+            self.errors += 1
+            self.last_error = error
+            self.last_error_time = time.time()
+
+    def age(self):
+        """
+        Seconds since the source was last known to be up to date. A
+        blocking query that is waiting would have returned on a change,
+        so its source is up to date until the query is overdue.
+        """
+        if self.parked_since is not None and self.last_success is not None:
+            return max(time.time() - self.parked_since - self.max_wait, 0)
+        if self.last_success is None:
+            return None
+        return time.time() - self.last_success
+
+    def to_dict(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'total_time': self.total_time,
+                'last_duration': self.last_duration,
+                'last_items': self.last_items,
+                'last_success': self.last_success,
+                'age': self.age(),
+                'contacts': self.contacts,
+                'parked': self.parked_since is not None,
+                'last_error': self.last_error,
+                'last_error_time': self.last_error_time}
+
+
+def source(name):
+    stats = SOURCES.get(name, None)
+    if stats is None:
+        stats = SourceStats(name)
+        SOURCES[name] = stats
+    return stats
+
+
+class Measurement(object):
+    def __init__(self):
+        self.items = None
+
+
+@contextlib.contextmanager
+def measure(name):
+    """
+    Times the block as one refresh of source 'name'. The block may set
+    'items' of the yielded object to the size of what it received.
+    Exceptions are recorded and re-raised.
+    """
+    measurement = Measurement()
+    start = time.time()
+
+    try:
+        yield measurement
+    except BaseException as ex:
+        source(name).observe(time.time() - start, error=repr(ex))
+        raise
+
+    source(name).observe(time.time() - start, measurement.items)
+
+
+@contextlib.contextmanager
+def watch(name, max_wait):
+    """
+    Wraps a blocking query of source 'name' that waits for a change for
+    up to 'max_wait' seconds. How long that takes says how long nothing
+    changed rather than how fast the source is, so it is counted as a
+    contact and left out of the latency statistics.
+    """
+    measurement = Measurement()
+    stats = source(name)
+    stats.parked_since = time.time()
+    stats.max_wait = max_wait
+
+    try:
+        yield measurement
+    except BaseException as ex:
+        stats.contact(error=repr(ex))
+        raise
+
+    stats.contact(measurement.items)
+
+
+def payload_items(data):
+    """
+    Size of a Consul or Docker response, in entries.
+    """
+    if isinstance(data, (list, dict)):
+        return len(data)
+    if data is None:
+        return 0
+    return 1
+
+
+def stats():
+    return {name: stats.to_dict() for name, stats in SOURCES.items()}
@@ -2,16 +2,51 @@
 
 import global_env
 import consul
+import consul_pool
 import docker
-import re
+import docker_pool
+import metrics
 import time
 import dateutil.parser
 import collections
 import logging
 import gevent
+import gevent.pool
+import gevent.event
 import requests
+import os
+import json
+import gzip
+import base64
+import random
 
 DOCKER_API_TIMEOUT = 10 # seconds
+DOCKER_POLL_DEADLINE = DOCKER_API_TIMEOUT + 5 # seconds
+DOCKER_EVENTS_RETRY_INTERVAL = 10 # seconds
+DOCKER_POLL_TICK = 1 # seconds
+DOCKER_POLL_INTERVAL = 10 # seconds
+# hosts with a live event stream only need their info refreshed
+DOCKER_SLOW_POLL_INTERVAL = 60 # seconds
+# hosts an operation has just touched
+DOCKER_FAST_POLL_INTERVAL = 2 # seconds
+DOCKER_FAST_POLL_WINDOW = 60 # seconds
+RETRY_BACKOFF_MAX = 300 # seconds
+SNAPSHOT_SAVE_INTERVAL = 10 # seconds
+DOCKER_CONTAINER_EVENTS = ('create', 'start', 'restart', 'die', 'stop',
+                           'kill', 'pause', 'unpause', 'rename', 'update',
+                           'destroy')
+CONSUL_WATCH_WAIT = '5m'
+# the wait above, plus up to 1/16 of it that Consul adds at random
+CONSUL_WATCH_MAX_WAIT = 330 # seconds
+CONSUL_WATCH_RETRY_INTERVAL = 10 # seconds
+CONSUL_WATCH_BACKOFF_BASE = 1 # seconds
+CONSUL_WATCH_BACKOFF_MAX = 60 # seconds
+# how long KV read by refresh_group() wins over an older watcher update
+KV_REFRESH_HOLD_TIME = 60 # seconds
+SNAPSHOT_FILE_VERSION = 2
+# parts of global_env that are saved to the snapshot file
+PERSISTENT_PARTS = ('kv', 'settings', 'backups', 'services', 'nodes',
+                    'containers', 'docker_info', 'docker_statuses')
 
 def consul_kv_to_dict(consul_kv_list):
     result = {}
@@ -31,190 +66,795 @@ def combine_consul_statuses(statuses):
             total = 'warning'
     return total
 
-class Sense(object):
-    @classmethod
-    def update(cls):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+class Snapshot(object):
+    """
+    Parsed view of the 'tarantool', 'tarantool_settings' and
+    'tarantool_backups' KV trees. It is built once when new data
+    arrives and is shared by all readers, so it must not be modified.
+    """
+    def __init__(self, blueprints=None, allocations=None, backups=None,
+                 settings=None):
+        self.blueprints = blueprints or {}
+        self.allocations = allocations or {}
+        self.backups = backups or {}
+        self.settings = settings or {}
 
-        kv = consul_obj.kv.get('tarantool', recurse=True)[1] or []
-        settings = consul_obj.kv.get('tarantool_settings', recurse=True)[1] or []
-        backups = consul_obj.kv.get('tarantool_backups', recurse=True)[1] or []
-        service_names = consul_obj.catalog.services()[1].keys()
+    @classmethod
+    def from_kv(cls, kv, settings, backups):
+        blueprints, allocations = parse_groups(kv)
+        return cls(blueprints, allocations,
+                   parse_backups(backups),
+                   parse_settings(settings))
 
-        services = {}
+    def replace(self, **parts):
+        """
+        Returns a new snapshot with some of the parts replaced.
+        """
+        kwargs = {'blueprints': self.blueprints,
+                  'allocations': self.allocations,
+                  'backups': self.backups,
+                  'settings': self.settings}
+        kwargs.update(parts)
+        return Snapshot(**kwargs)
+
+    def __eq__(self, other):
+        if not isinstance(other, Snapshot):
+            return False
+        return (self.blueprints, self.allocations,
+                self.backups, self.settings) == \
+            (other.blueprints, other.allocations,
+             other.backups, other.settings)
+
+
+EMPTY_SNAPSHOT = Snapshot()
+
+
+def encode_kv(consul_kv_list):
+    """
+    Makes consul KV items JSON-serializable. Values are bytes, so
+    they are stored base64-encoded.
+    """
+    result = []
+    for item in consul_kv_list:
+        item = dict(item)
+        if item.get('Value') is not None:
+            item['Value'] = base64.b64encode(item['Value']).decode('ascii')
+        result.append(item)
+    return result
 
-        for service_name in service_names:
-            services[service_name] = consul_obj.health.service(service_name)[1]
 
-        nodes = consul_obj.catalog.nodes()[1] or []
+def decode_kv(consul_kv_list):
+    result = []
+    for item in consul_kv_list:
+        item = dict(item)
+        if item.get('Value') is not None:
+            item['Value'] = base64.b64decode(item['Value'])
+        result.append(item)
+    return result
 
-        containers = {}
-        docker_info = {}
 
-        for entry in services.get('docker', []):
-            addr = entry['Service']['Address'] or entry['Node']['Address']
-            port = entry['Service']['Port']
-            if port:
-                addr = addr + ':' + str(port)
+class Record(object):
+    """
+    Compact, read-only projection of a raw Consul or Docker response
+    that keeps only the fields Sense needs.
+    """
+    __slots__ = ()
 
-            statuses = [check['Status'] for check in entry['Checks']]
-            docker_host_status = global_env.docker_statuses.get(addr, None)
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
 
-            if all([s == 'passing' for s in statuses]) and \
-               docker_host_status == 'passing':
+    def values(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
 
-                docker_obj = docker.Client(base_url=addr,
-                                           tls=global_env.docker_tls_config,
-                                           timeout=DOCKER_API_TIMEOUT)
-                containers[entry['Node']['Address']] = \
-                    docker_obj.containers(all=True)
+    def __eq__(self, other):
+        return type(self) is type(other) and self.values() == other.values()
 
-                docker_info[entry['Node']['Address']] = \
-                    docker_obj.info()
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name))
+                                     for name in self.__slots__))
 
-        global_env.kv = kv
-        global_env.settings = settings
-        global_env.backups = backups
-        global_env.services = services
-        global_env.containers = containers
-        global_env.docker_info = docker_info
-        global_env.nodes = nodes
+    def to_dict(self):
+        return dict(zip(self.__slots__, self.values()))
 
     @classmethod
-    def blueprints(cls):
-        """
-        returns a list of registered groups:
-        {
-            'type': '<blueprint type>',
-            'name': '<group name>',
-            'memsize': <amount of memory>,
-            'instances': {
-                '1': {'addr': '<ip addr>'},
-                '2': {'addr': '<ip addr>'}
-            }
-        }
-        """
-        tarantool_kv = consul_kv_to_dict(global_env.kv)
+    def from_dict(cls, fields):
+        return cls(**fields)
 
-        groups = {}
-        for key, value in tarantool_kv.items():
-            match = re.match('tarantool/(.*)/blueprint/type', key)
-            if match:
-                groups[match.group(1)] = {'type': value,
-                                          'instances': {}}
 
-        for key, value in tarantool_kv.items():
-            match = re.match('tarantool/(.*)/blueprint/memsize', key)
-            if match:
-                groups[match.group(1)]['memsize'] = int(value)
+class ServiceEntry(Record):
+    """
+    Consul health entry of a service instance. 'status' combines all
+    checks, while 'passing' is only true if every check passes.
+    """
+    __slots__ = ('id', 'service', 'tags', 'addr', 'port', 'node_addr',
+                 'status', 'passing', 'mem_used')
 
-            match = re.match('tarantool/(.*)/blueprint/creation_time', key)
-            if match:
-                groups[match.group(1)]['creation_time'] = dateutil.parser.parse(value)
 
-            match = re.match('tarantool/(.*)/blueprint/name', key)
-            if match:
-                groups[match.group(1)]['name'] = value
+class ContainerEntry(Record):
+    """
+    Tarantool container of a docker host. 'networks' maps network name
+    to the IPv4 address of the container in that network.
+    """
+    __slots__ = ('id', 'name', 'is_running', 'image', 'image_id', 'networks')
 
-            match = re.match('tarantool/(.*)/blueprint/check_period', key)
-            if match:
-                groups[match.group(1)]['check_period'] = int(value)
 
-        for key, value in tarantool_kv.items():
-            match = re.match('tarantool/(.*)/blueprint/instances/(.*)/addr', key)
-            if match:
-                groups[match.group(1)]['instances'][match.group(2)] = \
-                    {'addr': None}
+class DockerInfo(Record):
+    """
+    Capacity of a docker host, memory in megabytes.
+    """
+    __slots__ = ('cpus', 'memory')
 
-        for key, value in tarantool_kv.items():
-            match = re.match('tarantool/(.*)/blueprint/instances/(.*)/addr', key)
-            if match:
-                group = match.group(1)
-                instance_id = match.group(2)
 
-                groups[group]['instances'][instance_id]['addr'] = \
-                    value
+class ConsulNode(Record):
+    __slots__ = ('name', 'addr')
 
 
+# Services Sense keeps besides the ones tagged 'tarantool'
+WATCHED_SERVICES = ('docker', 'consul')
 
-        return groups
 
-    @classmethod
-    def allocations(cls):
-        tarantool_kv = consul_kv_to_dict(global_env.kv)
+def make_service_entry(service_id, service, tags, addr, port, node_addr,
+                       checks):
+    statuses = [check['Status'] for check in checks]
+    mem = 0
 
-        groups = {}
-        for key, value in tarantool_kv.items():
-            match = re.match('tarantool/(.*)/allocation/instances/(.*)/host',
-                             key)
-            if match:
-                group = match.group(1)
-                instance_id = match.group(2)
-                if group not in groups:
-                    groups[group] = {'instances': {}}
-                if instance_id not in groups[group]['instances']:
-                    groups[group]['instances'][instance_id] = {}
+    for check in checks:
+        if check['Name'] == 'Memory Utilization':
+            try:
+                mem = int(int(check['Output']) / (1024**2))
+            except ValueError:
+                pass
+
+    return ServiceEntry(id=service_id,
+                        service=service,
+                        tags=tags or [],
+                        addr=addr or node_addr,
+                        port=port,
+                        node_addr=node_addr,
+                        status=combine_consul_statuses(statuses),
+                        passing=all([s == 'passing' for s in statuses]),
+                        mem_used=mem)
+
+
+def project_service_entries(entries):
+    """
+    Projects a health.service() response.
+    """
+    return [make_service_entry(entry['Service']['ID'],
+                               entry['Service']['Service'],
+                               entry['Service']['Tags'],
+                               entry['Service']['Address'],
+                               entry['Service']['Port'],
+                               entry['Node']['Address'],
+                               entry['Checks'])
+            for entry in entries or []]
+
+
+def watched_service_names(catalog_services):
+    """
+    Picks the services Sense needs out of a catalog.services() response,
+    which maps service names to their tags.
+    """
+    return {name for name, tags in (catalog_services or {}).items()
+            if 'tarantool' in (tags or []) or name in WATCHED_SERVICES}
+
+
+def group_checks(checks):
+    """
+    Groups a health.state() response by (node, service id). Node-wide
+    checks have an empty service id.
+    """
+    result = collections.defaultdict(list)
+    for check in checks or []:
+        result[(check['Node'], check['ServiceID'])].append(check)
+    return result
 
-                groups[group]['instances'][instance_id]['host'] = \
-                    value
 
-        return groups
+def join_service_entries(catalog_entries, checks):
+    """
+    Builds the same records as project_service_entries() out of a
+    catalog.service() response and checks grouped by group_checks().
+    As in health.service(), node-wide checks count for every service
+    on the node.
+    """
+    return [make_service_entry(entry['ServiceID'],
+                               entry['ServiceName'],
+                               entry['ServiceTags'],
+                               entry['ServiceAddress'],
+                               entry['ServicePort'],
+                               entry['Address'],
+                               checks.get((entry['Node'], ''), []) +
+                               checks.get((entry['Node'],
+                                           entry['ServiceID']), []))
+            for entry in catalog_entries or []]
+
+
+def project_node_services(catalog_node, checks):
+    """
+    Builds the same records as project_service_entries() out of a
+    catalog.node() response and the health.node() checks of that node.
+    """
+    if not catalog_node:
+        return []
+
+    node = catalog_node['Node']
+    checks = group_checks(checks)
+    return [make_service_entry(service['ID'],
+                               service['Service'],
+                               service['Tags'],
+                               service['Address'],
+                               service['Port'],
+                               node['Address'],
+                               checks.get((node['Node'], ''), []) +
+                               checks.get((node['Node'], service['ID']), []))
+            for service in (catalog_node['Services'] or {}).values()]
+
+
+def join_services(catalog, checks):
+    """
+    Joins catalog entries, by service name, with the checks of the
+    whole cluster into the contents of global_env.services.
+    """
+    checks = group_checks(checks)
+    return {name: join_service_entries(entries, checks)
+            for name, entries in catalog.items()}
+
+
+def project_containers(containers):
+    """
+    Keeps only tarantool containers, and only what the views need.
+    """
+    result = []
+
+    for container in containers or []:
+        if 'tarantool' not in (container['Labels'] or {}):
+            continue
+
+        networks = {}
+        for name, net in (container['NetworkSettings']['Networks'] or
+                          {}).items():
+            ipam_config = net.get('IPAMConfig', None) or {}
+            networks[name] = ipam_config.get('IPv4Address', None)
+
+        result.append(ContainerEntry(
+            id=container['Id'],
+            name=container['Names'][0].lstrip('/'),
+            is_running=container['State'] == 'running',
+            image=container['Image'],
+            image_id=container['ImageID'].split(':')[1],
+            networks=networks))
 
-    @classmethod
-    def backups(cls):
-        backups_kv = consul_kv_to_dict(global_env.backups)
+    return result
 
-        backups = collections.defaultdict(dict)
 
-        for key, value in backups_kv.items():
-            match = re.match('tarantool_backups/(.*)/type',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['type'] = value
+def project_docker_info(info):
+    return DockerInfo(cpus=int(info['NCPU']),
+                      memory=int(int(info['MemTotal']) / (1024**2)))
+
+
+def project_nodes(nodes):
+    return [ConsulNode(name=node['Node'], addr=node['Address'])
+            for node in nodes or []]
+
+
+def map_values(func, depth):
+    """
+    Returns a function that applies 'func' to values nested 'depth'
+    levels deep in dicts and lists.
+    """
+    def apply(value, depth=depth):
+        if depth == 0:
+            return func(value)
+        if isinstance(value, dict):
+            return {k: apply(v, depth - 1) for k, v in value.items()}
+        return [apply(v, depth - 1) for v in value]
+    return apply
+
+
+def to_dict(record):
+    return record.to_dict()
+
+
+# part name -> (encode, decode) for the snapshot file
+PART_CODECS = {
+    'kv': (encode_kv, decode_kv),
+    'settings': (encode_kv, decode_kv),
+    'backups': (encode_kv, decode_kv),
+    'services': (map_values(to_dict, 2),
+                 map_values(ServiceEntry.from_dict, 2)),
+    'nodes': (map_values(to_dict, 1), map_values(ConsulNode.from_dict, 1)),
+    'containers': (map_values(to_dict, 2),
+                   map_values(ContainerEntry.from_dict, 2)),
+    'docker_info': (map_values(to_dict, 1),
+                    map_values(DockerInfo.from_dict, 1))
+}
+
+
+# a group is only published once all of these are written, since the
+# watchers see every key of a new group as soon as it is written
+BLUEPRINT_FIELDS = ('type', 'name', 'memsize', 'creation_time')
+
+
+def parse_groups(consul_kv_list):
+    """
+    Parses 'tarantool/<group>/...' keys into blueprints and allocations,
+    indexed by group id.
+    """
+    blueprints = {}
+    allocations = {}
+
+    for key, value in consul_kv_to_dict(consul_kv_list).items():
+        parts = key.split('/')
+        if len(parts) < 4:
+            continue
+        group_id, section, field = parts[1], parts[2], parts[3:]
+
+        if section == 'blueprint':
+            blueprint = blueprints.setdefault(group_id, {'instances': {}})
+            if field == ['type']:
+                blueprint['type'] = value
+            elif field == ['name']:
+                blueprint['name'] = value
+            elif field == ['memsize']:
+                blueprint['memsize'] = int(value)
+            elif field == ['check_period']:
+                blueprint['check_period'] = int(value)
+            elif field == ['creation_time']:
+                blueprint['creation_time'] = dateutil.parser.parse(value)
+            elif len(field) == 3 and field[0] == 'instances' and \
+                 field[2] == 'addr':
+                blueprint['instances'][field[1]] = {'addr': value}
+
+        elif section == 'allocation':
+            if len(field) == 3 and field[0] == 'instances' and \
+               field[2] == 'host':
+                allocation = allocations.setdefault(group_id,
+                                                    {'instances': {}})
+                allocation['instances'][field[1]] = {'host': value}
+
+    blueprints = {group_id: blueprint
+                  for group_id, blueprint in blueprints.items()
+                  if all(field in blueprint for field in BLUEPRINT_FIELDS)}
+
+    return blueprints, allocations
+
+
+# a backup is only published once all of these are written
+BACKUP_FIELDS = {'type': str,
+                 'group_id': str,
+                 'archive_id': str,
+                 'storage': str,
+                 'creation_time': dateutil.parser.parse,
+                 'size': int,
+                 'mem_used': int}
+
+
+def parse_backups(consul_kv_list):
+    backups = collections.defaultdict(dict)
+
+    for key, value in consul_kv_to_dict(consul_kv_list).items():
+        parts = key.split('/')
+        if len(parts) != 3 or parts[2] not in BACKUP_FIELDS:
+            continue
+        backup_id, field = parts[1], parts[2]
+        backups[backup_id][field] = BACKUP_FIELDS[field](value)
+
+    return {backup_id: backup for backup_id, backup in backups.items()
+            if len(backup) == len(BACKUP_FIELDS)}
+
+
+def parse_settings(consul_kv_list):
+    settings = {}
+
+    for key, value in consul_kv_to_dict(consul_kv_list).items():
+        if key == 'tarantool_settings/network_name':
+            settings['network_name'] = value
+
+        if key == 'tarantool_settings/subnet':
+            settings['subnet'] = value
+
+    return settings
+
+
+def backoff_delay(failures, base, cap=RETRY_BACKOFF_MAX):
+    """
+    Delay before the next attempt after 'failures' failures in a row. It
+    doubles with every failure up to 'cap', and is randomized by up to
+    a half, so that sources that failed together don't retry together.
+    """
+    delay = min(cap, base * 2 ** min(failures - 1, 16))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class ConsulWatcher(object):
+    """
+    Runs a Consul blocking query in a loop. 'fetch' is called with a
+    consul client and the X-Consul-Index of the previous response, and
+    must return a new (index, data) pair. 'apply' is called with the
+    data whenever the index changes.
+    """
+    def __init__(self, name, fetch, apply):
+        self.name = name
+        self.fetch = fetch
+        self.apply = apply
+        self.index = None
+        self.failures = 0
+        self.greenlet = None
+
+    def start(self):
+        self.greenlet = gevent.spawn(self.run)
+
+    def stop(self):
+        if self.greenlet:
+            self.greenlet.kill(block=False)
+            self.greenlet = None
+
+    def retry_later(self):
+        self.failures += 1
+        time.sleep(backoff_delay(self.failures, CONSUL_WATCH_BACKOFF_BASE,
+                                 CONSUL_WATCH_BACKOFF_MAX))
+
+    def run(self):
+        consul_obj = consul_pool.get_client()
 
-            match = re.match('tarantool_backups/(.*)/group_id',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['group_id'] = value
+        while True:
+            try:
+                # Only the first query of a watcher answers right away
+                if self.index is None:
+                    measure = metrics.measure('consul:' + self.name)
+                else:
+                    measure = metrics.watch('consul:' + self.name,
+                                            CONSUL_WATCH_MAX_WAIT)
+
+                with measure as measurement:
+                    index, data = self.fetch(consul_obj, self.index)
+                    measurement.items = metrics.payload_items(data)
+                self.failures = 0
+
+                if index is not None and self.index is not None and \
+                   int(index) < int(self.index):
+                    # Index went backwards (e.g. Consul was restarted),
+                    # so the only safe thing is to start over
+                    logging.info("Consul index of '%s' was reset", self.name)
+                    self.index = None
+                    continue
 
-            match = re.match('tarantool_backups/(.*)/archive_id',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['archive_id'] = value
+                if index is None:
+                    # Not a blocking query, so poll it instead
+                    self.apply(data)
+                    time.sleep(CONSUL_WATCH_RETRY_INTERVAL)
+                elif index != self.index:
+                    self.index = index
+                    self.apply(data)
+            except consul.base.ConsulException as ex:
+                if "No cluster leader" in str(ex):
+                    logging.warn("Won't watch '%s': no consul leader",
+                                 self.name)
+                else:
+                    logging.exception("Failed to watch '%s'", self.name)
+                self.retry_later()
+            except Exception:
+                logging.exception("Failed to watch '%s'", self.name)
+                self.retry_later()
 
-            match = re.match('tarantool_backups/(.*)/creation_time',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['creation_time'] = dateutil.parser.parse(value)
 
-            match = re.match('tarantool_backups/(.*)/storage',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['storage'] = value
+def watch_kv(prefix):
+    def fetch(consul_obj, index):
+        return consul_obj.kv.get(prefix, recurse=True, index=index,
+                                 wait=CONSUL_WATCH_WAIT)
+    return fetch
 
-            match = re.match('tarantool_backups/(.*)/size',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['size'] = int(value)
 
-            match = re.match('tarantool_backups/(.*)/mem_used',
-                             key)
-            if match:
-                backup_id = match.group(1)
-                backups[backup_id]['mem_used'] = int(value)
+def watch_catalog_services(consul_obj, index):
+    return consul_obj.catalog.services(index=index, wait=CONSUL_WATCH_WAIT)
 
 
-        return dict(backups)
+def watch_catalog_nodes(consul_obj, index):
+    return consul_obj.catalog.nodes(index=index, wait=CONSUL_WATCH_WAIT)
 
-    @classmethod
-    def services(cls):
+
+def watch_catalog_service(service_name):
+    def fetch(consul_obj, index):
+        return consul_obj.catalog.service(service_name, index=index,
+                                          wait=CONSUL_WATCH_WAIT)
+    return fetch
+
+
+def watch_health_state(consul_obj, index):
+    return consul_obj.health.state('any', index=index, wait=CONSUL_WATCH_WAIT)
+
+
+class DockerEventWatcher(object):
+    """
+    Keeps the container inventory of one docker host up to date by
+    following its /events stream. The full container list is only
+    fetched when the stream is (re)connected. After that every event
+    re-reads just the container it is about.
+    """
+    def __init__(self, addr, consul_host):
+        self.addr = addr
+        self.consul_host = consul_host
+        self.synced = False
+        self.failures = 0
+        self.greenlet = None
+
+    def start(self):
+        self.greenlet = gevent.spawn(self.run)
+
+    def stop(self):
+        self.synced = False
+        if self.greenlet:
+            self.greenlet.kill(block=False)
+            self.greenlet = None
+
+    def run(self):
+        while True:
+            # The event stream holds its connection forever, so it
+            # can't use a pooled client
+            docker_obj = docker.Client(base_url=self.addr,
+                                       tls=global_env.docker_tls_config,
+                                       timeout=DOCKER_API_TIMEOUT)
+            events = None
+
+            try:
+                with metrics.measure('docker_events:' + self.addr) as \
+                     measurement:
+                    # Subscribe before listing, so that nothing that
+                    # happens in between is lost
+                    events = docker_obj.events(filters={'type': 'container',
+                                                        'label': 'tarantool'},
+                                               decode=True)
+
+                    containers = docker_obj.containers(
+                        all=True, filters={'label': 'tarantool'})
+                    measurement.items = len(containers)
+
+                self.set_containers(project_containers(containers))
+                self.synced = True
+                self.failures = 0
+
+                for event in events:
+                    self.apply_event(docker_obj, event)
+
+                logging.info("Docker event stream of %s closed", self.addr)
+            except Exception as ex:
+                logging.error("Failed to follow events of docker node %s: %s",
+                              self.addr, repr(ex))
+            finally:
+                # Also runs when the watcher is stopped, so that neither
+                # the stream nor the client's sockets outlive it
+                if events is not None:
+                    docker_pool.close_stream(events)
+                docker_obj.close()
+
+            self.synced = False
+            self.failures += 1
+            time.sleep(backoff_delay(self.failures,
+                                     DOCKER_EVENTS_RETRY_INTERVAL))
+
+    def apply_event(self, docker_obj, event):
+        action = event.get('Action') or event.get('status')
+        container_id = event.get('id')
+
+        if action not in DOCKER_CONTAINER_EVENTS or not container_id:
+            return
+
+        changed = []
+        if action != 'destroy':
+            changed = project_containers(docker_obj.containers(
+                all=True, filters={'id': container_id}))
+
+        containers = [c for c in global_env.containers.get(self.consul_host, [])
+                      if c.id != container_id]
+        self.set_containers(containers + changed)
+
+    def set_containers(self, host_containers):
+        containers = dict(global_env.containers)
+        containers[self.consul_host] = host_containers
+        Sense.publish(containers=containers)
+
+
+class SingleFlight(object):
+    """
+    Runs at most one call per key at a time. Whoever calls run() while
+    a call with the same key is in flight waits for it and gets its
+    result (or exception) instead of starting another one, but only if
+    that call started after 'since'. A call that started earlier
+    may miss a change the caller made before calling, so the caller
+    waits for it to end and then joins or starts the next one, which
+    is shared by everyone who piled up meanwhile.
+    """
+    def __init__(self):
+        # key -> (start time, AsyncResult)
+        self.calls = {}
+
+    def run(self, key, func, *args, since=None):
+        while True:
+            started, call = self.calls.get(key, (None, None))
+            if call is None:
+                break
+            if since is None or started > since:
+                return call.get()
+            # Its outcome is of no use here, only its end
+            call.wait()
+
+        call = gevent.event.AsyncResult()
+        self.calls[key] = (time.time(), call)
+
+        try:
+            result = func(*args)
+            call.set(result)
+            return result
+        except Exception as ex:
+            call.set_exception(ex)
+            raise
+        finally:
+            del self.calls[key]
+
+
+class PollSchedule(object):
+    """
+    Decides when each docker host is polled next. Healthy hosts are
+    polled every DOCKER_POLL_INTERVAL seconds, or less often if their
+    containers come from an event stream anyway. Failing hosts back off
+    exponentially, and hosts touched by an operation are polled often
+    for a while.
+    """
+    def __init__(self):
+        self.next_poll = {}
+        self.failures = {}
+        self.fast_until = {}
+
+    def due(self, addrs):
+        now = time.time()
+        return [addr for addr in addrs if self.next_poll.get(addr, 0) <= now]
+
+    def succeeded(self, addr, synced):
+        now = time.time()
+        self.failures.pop(addr, None)
+
+        if self.fast_until.get(addr, 0) > now:
+            interval = DOCKER_FAST_POLL_INTERVAL
+        elif synced:
+            interval = DOCKER_SLOW_POLL_INTERVAL
+        else:
+            interval = DOCKER_POLL_INTERVAL
+
+        self.next_poll[addr] = now + interval
+
+    def failed(self, addr):
+        failures = self.failures.get(addr, 0) + 1
+        self.failures[addr] = failures
+        self.next_poll[addr] = time.time() + backoff_delay(
+            failures, DOCKER_POLL_INTERVAL)
+
+    def expedite(self, addr):
+        now = time.time()
+        self.fast_until[addr] = now + DOCKER_FAST_POLL_WINDOW
+        if addr not in self.failures:
+            self.next_poll[addr] = now
+
+    def forget(self, addrs):
+        """
+        Drops the schedule of hosts that are not in 'addrs'.
+        """
+        for table in (self.next_poll, self.failures, self.fast_until):
+            for addr in list(table):
+                if addr not in addrs:
+                    del table[addr]
+
+    def to_dict(self):
+        return {addr: {'next_poll': next_poll,
+                       'failures': self.failures.get(addr, 0),
+                       'fast_until': self.fast_until.get(addr, None)}
+                for addr, next_poll in self.next_poll.items()}
+
+
+def poll_docker_hosts(addrs, poll):
+    """
+    Calls poll(addr) for every docker address concurrently, with at most
+    global_env.docker_poll_concurrency calls in flight. Every call is
+    cut off after DOCKER_POLL_DEADLINE seconds, so the total time is
+    bounded by the slowest host rather than by the sum over all hosts.
+
+    Returns a dict of results and a dict of exceptions, both keyed by
+    address. Hosts that ran out of time have a gevent.Timeout there.
+    """
+    results = {}
+    errors = {}
+
+    def run(addr):
+        try:
+            with gevent.Timeout(DOCKER_POLL_DEADLINE):
+                results[addr] = poll(addr)
+        except gevent.Timeout as ex:
+            errors[addr] = ex
+        except Exception as ex:
+            errors[addr] = ex
+
+    pool = gevent.pool.Pool(global_env.docker_poll_concurrency)
+    for addr in addrs:
+        pool.spawn(run, addr)
+    pool.join()
+
+    return results, errors
+
+
+def memoized_view(func):
+    """
+    Caches the result of a State view in the State itself.
+    """
+    name = func.__name__
+
+    def wrapper(self):
+        if name in self.views:
+            VIEW_STATS[name]['hits'] += 1
+            return self.views[name]
+
+        VIEW_STATS[name]['misses'] += 1
+        result = func(self)
+        self.views[name] = result
+        return result
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = func.__doc__
+    return wrapper
+
+
+VIEW_STATS = collections.defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+
+class State(object):
+    """
+    Everything Sense knows at one generation. All parts of global_env
+    are replaced rather than modified on update, so a State stays
+    consistent no matter what is published after it was taken. Views
+    are built on first use and cached for the lifetime of the State.
+    """
+    def __init__(self):
+        self.generation = global_env.generation
+        self.snapshot = global_env.snapshot or EMPTY_SNAPSHOT
+        self.service_entries = global_env.services
+        self.container_entries = global_env.containers
+        self.docker_info = global_env.docker_info
+        self.docker_statuses = global_env.docker_statuses
+        self.nodes = global_env.nodes
+        self.views = {}
+
+    def blueprints(self):
+        """
+        returns a list of registered groups:
+        {
+            'type': '<blueprint type>',
+            'name': '<group name>',
+            'memsize': <amount of memory>,
+            'instances': {
+                '1': {'addr': '<ip addr>'},
+                '2': {'addr': '<ip addr>'}
+            }
+        }
+        """
+        return self.snapshot.blueprints
+
+    def blueprint(self, group_id):
+        return self.snapshot.blueprints.get(group_id, None)
+
+    def allocations(self):
+        return self.snapshot.allocations
+
+    def allocation(self, group_id):
+        return self.snapshot.allocations.get(group_id, None)
+
+    def backups(self):
+        return self.snapshot.backups
+
+    def backup(self, backup_id):
+        return self.snapshot.backups.get(backup_id, None)
+
+    @memoized_view
+    def services(self):
         """
         returns a list of allocated groups:
         {
@@ -228,64 +868,40 @@ class Sense(object):
         """
         groups = {}
 
-        for service_name, service in global_env.services.items():
+        for service_name, service in self.service_entries.items():
             for entry in service:
-                if not entry['Service']['Tags'] or \
-                   'tarantool' not in entry['Service']['Tags']:
+                if 'tarantool' not in entry.tags:
                     continue
 
-                group, instance_id = entry['Service']['ID'].split('_')
-                host = entry['Service']['Address'] or entry['Node']['Address']
-                port = entry['Service']['Port']
-                addr = '%s:%s' % (host, port)
-                node = entry['Node']['Address']
-                mem = 0
-
-                for check in entry['Checks']:
-                    if check['Name'] == 'Memory Utilization':
-                        try:
-                            mem = int(int(check['Output']) / (1024**2))
-                        except ValueError:
-                            pass
-
-                statuses = [check['Status'] for check in entry['Checks']]
-                status = combine_consul_statuses(statuses)
+                group, instance_id = entry.id.split('_')
 
                 if group not in groups:
                     groups[group] = {}
-                    groups[group]['type'] = entry['Service']['Service']
+                    groups[group]['type'] = entry.service
                     groups[group]['instances'] = {}
 
                 groups[group]['instances'][instance_id] = {
-                    'addr': addr,
-                    'port': port,
-                    'status': status,
-                    'host': node,
-                    'mem_used': mem}
+                    'addr': '%s:%s' % (entry.addr, entry.port),
+                    'port': entry.port,
+                    'status': entry.status,
+                    'host': entry.node_addr,
+                    'mem_used': entry.mem_used}
 
         return groups
 
-    @classmethod
-    def containers(cls):
+    @memoized_view
+    def containers(self):
         groups = {}
 
-        network_settings = cls.network_settings()
+        network_settings = self.network_settings()
         network_name = network_settings['network_name']
 
-        for host in global_env.containers:
-            for container in global_env.containers[host]:
-                if 'tarantool' not in container['Labels']:
-                    continue
-
-                instance_name = container['Names'][0].lstrip('/')
-                group, instance_id = instance_name.split('_')
+        for host in self.container_entries:
+            for container in self.container_entries[host]:
+                group, instance_id = container.name.split('_')
                 addr = None
-                if network_name in container['NetworkSettings']['Networks']:
-                    net = container['NetworkSettings']['Networks'][network_name]
-                    addr = net['IPAMConfig']['IPv4Address'] + ':3301'
-                is_running = container['State'] == 'running'
-                image_name = container['Image']
-                image_id = container['ImageID'].split(':')[1]
+                if container.networks.get(network_name, None):
+                    addr = container.networks[network_name] + ':3301'
 
                 if group not in groups:
                     groups[group] = {}
@@ -294,46 +910,41 @@ class Sense(object):
                 groups[group]['instances'][instance_id] = {
                     'addr': addr,
                     'host': host,
-                    'is_running': is_running,
-                    'docker_image_name': image_name,
-                    'docker_image_id': image_id
+                    'is_running': container.is_running,
+                    'docker_image_name': container.image,
+                    'docker_image_id': container.image_id
                 }
 
         return groups
 
-    @classmethod
-    def docker_hosts(cls):
-        if 'docker' not in global_env.services:
+    @memoized_view
+    def docker_hosts(self):
+        if 'docker' not in self.service_entries:
             return []
 
         result = []
-        for entry in global_env.services['docker']:
-            statuses = [check['Status'] for check in entry['Checks']]
-            status = combine_consul_statuses(statuses)
-
-            service_addr = entry['Service']['Address'] or entry['Node']['Address']
-            tags = entry['Service']['Tags'] or []
-            port = entry['Service']['Port']
-            consul_host = entry['Node']['Address']
+        for entry in self.service_entries['docker']:
+            status = entry.status
+            consul_host = entry.node_addr
             cpus = 0
             memory = 0
-            if consul_host in global_env.docker_info:
-                info = global_env.docker_info[consul_host]
+            if consul_host in self.docker_info:
+                info = self.docker_info[consul_host]
 
-                cpus = int(info['NCPU'])
-                memory = int(int(info['MemTotal']) / (1024**2))
+                cpus = info.cpus
+                memory = info.memory
 
-            addr = service_addr
-            if port:
-                addr += ':' + str(port)
+            addr = entry.addr
+            if entry.port:
+                addr += ':' + str(entry.port)
 
-            docker_host_status = global_env.docker_statuses.get(addr, None)
+            docker_host_status = self.docker_statuses.get(addr, None)
 
             if docker_host_status != 'passing':
                 status = docker_host_status
 
             result.append({'addr': addr,
-                           'tags': tags,
+                           'tags': entry.tags,
                            'consul_host': consul_host,
                            'status': status,
                            'cpus': cpus,
@@ -341,146 +952,781 @@ class Sense(object):
 
         return result
 
-    @classmethod
-    def network_settings(cls):
-        tarantool_kv = consul_kv_to_dict(global_env.settings)
-        result = {'network_name': None, 'subnet': None}
+    @memoized_view
+    def docker_host_index(self):
+        """
+        Maps IP address, docker address and consul host of every
+        docker host to its entry in docker_hosts(). If several hosts
+        share a key, the last one wins.
+        """
+        index = {}
 
-        default = global_env.default_network_settings
+        for host in self.docker_hosts():
+            index[host['addr'].split(':')[0]] = host
+            index[host['addr']] = host
+            index[host['consul_host']] = host
 
-        for key, value in tarantool_kv.items():
-            if key == 'tarantool_settings/network_name':
-                result['network_name'] = value
+        return index
+
+    def resolve_docker_host(self, host):
+        """
+        Returns the docker_hosts() entry for 'host', which may be
+        an IP address, a docker address or a consul host, or None
+        if there is no such host.
+        """
+        return self.docker_host_index().get(host, None)
 
-            if key == 'tarantool_settings/subnet':
-                result['subnet'] = value
+    @memoized_view
+    def network_settings(self):
+        settings = self.snapshot.settings
+        default = global_env.default_network_settings
 
-        result['network_name'] = result['network_name'] or default['network_name']
-        result['subnet'] = result['subnet'] or default['subnet']
+        result = {}
+        result['network_name'] = settings.get('network_name') or \
+            default['network_name']
+        result['subnet'] = settings.get('subnet') or default['subnet']
         result['gateway_ip'] = default['gateway_ip']
         result['create_automatically'] = default['create_automatically']
         return result
 
-    @classmethod
-    def consul_hosts(cls):
-        if 'consul' not in global_env.services:
+    @memoized_view
+    def consul_hosts(self):
+        if 'consul' not in self.service_entries:
             return []
 
         result = []
-        for entry in global_env.nodes:
-            service_addr = entry['Address']
-            name = entry['Node']
-
-            result.append({'addr': service_addr+':8300',
-                           'name': name,
+        for node in self.nodes:
+            result.append({'addr': node.addr + ':8300',
+                           'name': node.name,
                            'status': 'passing'})
 
         return result
 
+    @memoized_view
+    def group_health(self):
+        """
+        returns the health of every registered group:
+        {
+            '<group id>': {
+                'status': '<combined status>',
+                'instances': {'1': '<status>', '2': '<status>'}
+            }
+        }
+        Instances that have no service registered are 'critical'.
+        """
+        services = self.services()
+        result = {}
+
+        for group_id, blueprint in self.blueprints().items():
+            registered = services.get(group_id, {'instances': {}})
+            registered = registered['instances']
+
+            instances = {}
+            for instance_num in blueprint['instances']:
+                if instance_num in registered:
+                    instances[instance_num] = \
+                        registered[instance_num]['status']
+                else:
+                    instances[instance_num] = 'critical'
+
+            statuses = [i['status'] for i in registered.values()]
+            result[group_id] = {
+                'status': combine_consul_statuses(statuses),
+                'instances': instances}
+
+        return result
+
+
+class Sense(object):
+    service_watchers = {}
+    event_watchers = {}
+    # raw data that global_env.services is joined from
+    service_catalog = {}
+    health_checks = None
+    # name -> ConsulWatcher, of the watchers started by watch()
+    watchers = {}
+    # group id -> (X-Consul-Index, time) of KV read by refresh_group()
+    # that the 'tarantool/' watcher may not have seen yet
+    held_groups = {}
+    flights = SingleFlight()
+    schedule = PollSchedule()
+    # set and replaced whenever the generation changes
+    generation_changed = gevent.event.Event()
+    current_state = None
+
     @classmethod
-    def consul_kv_refresh(cls):
-        index = None
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+    def publish(cls, **parts):
+        """
+        Stores new state in global_env. The generation is bumped only
+        if some part actually differs from what is already there, so
+        cached views survive refreshes that bring nothing new.
+        Views must be treated as read-only, since they are shared.
+        """
+        changed = False
+        for name, value in parts.items():
+            global_env.stale_parts.discard(name)
+            if getattr(global_env, name) != value:
+                setattr(global_env, name, value)
+                changed = True
 
-        while True:
-            try:
-                index_new, kv = consul_obj.kv.get('tarantool', recurse=True,
-                                                  index=index)
+        if changed:
+            global_env.generation += 1
+            event, cls.generation_changed = \
+                cls.generation_changed, gevent.event.Event()
+            event.set()
 
-                if index_new != index and kv:
-                    global_env.kv = kv
-            except Exception:
-                time.sleep(10)
+        return changed
 
     @classmethod
-    def consul_service_refresh(cls):
-        index = None
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+    def wait_for_generation(cls, index, timeout):
+        """
+        Blocks until the generation is greater than 'index' or until
+        'timeout' seconds pass, like a Consul blocking query. Returns
+        the generation at that moment.
+
+        An 'index' ahead of the generation can only come from before a
+        restart, which starts the generation over, so like Consul after
+        an index reset it returns right away instead of waiting for the
+        generation to catch up.
+        """
+        if index > global_env.generation:
+            return global_env.generation
 
-        while True:
-            try:
-                index_new, kv = consul_obj.kv.get('tarantool', recurse=True,
-                                                  index=index)
+        deadline = time.time() + timeout
 
-                if index_new != index and kv:
-                    global_env.kv = kv
-            except Exception:
-                time.sleep(10)
+        while global_env.generation <= index:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            cls.generation_changed.wait(remaining)
+
+        return global_env.generation
 
     @classmethod
-    def docker_status_update(cls):
-        while True:
-            try:
-                try:
-                    consul_obj = consul.Consul(host=global_env.consul_host,
-                                           token=global_env.consul_acl_token)
-
-                    docker_status = {}
-                    services = consul_obj.health.service('docker')[1] or []
-                except consul.base.ConsulException as ex:
-                    if "No cluster leader" in str(ex):
-                        logging.warn(
-                            "Won't update docker status: no consul leader")
-                        continue
-
-                for entry in services:
-                    statuses = [check['Status'] for check in entry['Checks']]
-                    addr = entry['Service']['Address'] or entry['Node']['Address']
-                    port = entry['Service']['Port']
-                    if port:
-                        addr = addr + ':' + str(port)
-
-                    docker_status[addr] = 'passing'
-
-                    if all([s == 'passing' for s in statuses]):
-
-                        docker_obj = docker.Client(
-                            base_url=addr,
-                            tls=global_env.docker_tls_config,
-                            timeout=DOCKER_API_TIMEOUT)
-                        try:
-                            docker_obj.info()
-                            docker_obj.containers()
-                            docker_status[addr] = 'passing'
-                        except requests.exceptions.ReadTimeout as ex:
-                            logging.error("Timed out accessing docker node: %s",
-                                          addr)
-                            docker_status[addr] = 'critical'
-                        except requests.exceptions.ConnectionError as ex:
-                            logging.error("Can't connect to docker node: %s",
-                                          addr)
-                            docker_status[addr] = 'critical'
-                        except Exception as ex:
-                            logging.exception(
-                                "Failed to get data from docker: %s", addr)
-                            docker_status[addr] = 'critical'
-                    else:
-                        docker_status[addr] = 'critical'
-
-                global_env.docker_statuses = docker_status
-                time.sleep(10)
-            except Exception as ex:
-                logging.exception("Failed to update data from docker")
-                time.sleep(1)
+    def is_stale(cls):
+        """
+        True while some of the state still comes from the snapshot file
+        and hasn't been refreshed from Consul or Docker yet.
+        """
+        return bool(global_env.stale_parts)
+
+    @classmethod
+    def save_snapshot(cls, path):
+        """
+        Writes the current state to 'path' as gzipped JSON. The file is
+        written next to 'path' and then renamed over it, so readers
+        never see a partially written snapshot.
+        """
+        state = {}
+        for name in PERSISTENT_PARTS:
+            value = getattr(global_env, name)
+            if name in PART_CODECS:
+                value = PART_CODECS[name][0](value)
+            state[name] = value
+
+        data = {'version': SNAPSHOT_FILE_VERSION,
+                'timestamp': time.time(),
+                'state': state}
+
+        def write():
+            tmp_path = path + '.tmp'
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as stream:
+                json.dump(data, stream, separators=(',', ':'))
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.replace(tmp_path, path)
+
+        # Compression and fsync take long enough to stall every other
+        # greenlet, so they run in a thread. The encoded state is not
+        # shared with anyone, so the thread may read it safely.
+        gevent.get_hub().threadpool.apply(write)
+
+    @classmethod
+    def load_snapshot(cls, path):
+        """
+        Loads state saved by save_snapshot() and marks it stale until
+        every part is refreshed. Returns False if there's nothing usable
+        in 'path'.
+        """
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as stream:
+                data = json.load(stream)
+
+            if data.get('version', None) != SNAPSHOT_FILE_VERSION:
+                logging.warning(
+                    "Ignoring snapshot file %s of unknown version %s",
+                    path, data.get('version', None))
+                return False
+
+            state = data['state']
+            parts = {}
+            for name in PERSISTENT_PARTS:
+                value = state[name]
+                if name in PART_CODECS:
+                    value = PART_CODECS[name][1](value)
+                parts[name] = value
+            parts['snapshot'] = Snapshot.from_kv(parts['kv'],
+                                                 parts['settings'],
+                                                 parts['backups'])
+        except FileNotFoundError:
+            return False
+        except Exception:
+            # Starting cold is better than not starting at all
+            logging.exception("Failed to load snapshot file %s", path)
+            return False
+
+        cls.publish(**parts)
+        global_env.stale_parts = set(PERSISTENT_PARTS)
+
+        logging.info("Loaded snapshot from %s, saved %d seconds ago",
+                     path, time.time() - data['timestamp'])
+        return True
+
+    @classmethod
+    def view_stats(cls):
+        return {'generation': global_env.generation,
+                'views': {name: dict(stats)
+                          for name, stats in VIEW_STATS.items()}}
+
+    @classmethod
+    def update_docker(cls, force=False):
+        """
+        Polls the docker hosts that are due according to the schedule,
+        or all of them if 'force' is set, and publishes health status,
+        container list and host info of all hosts together, so that
+        these views never disagree with each other. Hosts that were not
+        polled keep what is known about them.
+        """
+        hosts = {}
+        docker_statuses = {}
+
+        for entry in global_env.services.get('docker', []):
+            addr = entry.addr
+            if entry.port:
+                addr = addr + ':' + str(entry.port)
+
+            hosts[addr] = entry.node_addr
+            if not entry.passing:
+                docker_statuses[addr] = 'critical'
+                docker_pool.evict(addr)
+
+        def poll(addr):
+            with metrics.measure('docker:' + addr) as measurement:
+                docker_obj = docker_pool.get_client(addr,
+                                                    timeout=DOCKER_API_TIMEOUT)
+                info = project_docker_info(docker_obj.info())
+
+                # containers of hosts with a live event stream are
+                # already up to date
+                watcher = cls.event_watchers.get(addr, None)
+                if watcher and watcher.synced:
+                    return None, info
+
+                containers = docker_obj.containers(
+                    all=True, filters={'label': 'tarantool'})
+                measurement.items = len(containers)
+
+            return project_containers(containers), info
+
+        addrs = [addr for addr in hosts if addr not in docker_statuses]
+        if not force:
+            addrs = cls.schedule.due(addrs)
+        cls.schedule.forget(hosts)
+
+        results, errors = poll_docker_hosts(addrs, poll)
+
+        containers = {}
+        docker_info = {}
+
+        for addr, consul_host in hosts.items():
+            if addr in results:
+                docker_statuses[addr] = 'passing'
+                containers[consul_host], docker_info[consul_host] = \
+                    results[addr]
+                cls.schedule.succeeded(addr,
+                                       synced=containers[consul_host] is None)
+                if containers[consul_host] is None:
+                    containers[consul_host] = \
+                        global_env.containers.get(consul_host, [])
+                continue
+
+            if addr not in errors:
+                if addr in docker_statuses or \
+                   addr not in global_env.docker_statuses:
+                    continue
+
+                # Not due yet
+                docker_statuses[addr] = global_env.docker_statuses[addr]
+                if consul_host in global_env.containers:
+                    containers[consul_host] = global_env.containers[consul_host]
+                if consul_host in global_env.docker_info:
+                    docker_info[consul_host] = global_env.docker_info[consul_host]
+                continue
+
+            ex = errors[addr]
+            docker_statuses[addr] = 'critical'
+            docker_pool.evict(addr)
+            cls.schedule.failed(addr)
+
+            if isinstance(ex, requests.exceptions.ConnectionError):
+                logging.error("Can't connect to docker node: %s", addr)
+                continue
+            elif not isinstance(ex, (gevent.Timeout,
+                                     requests.exceptions.ReadTimeout)):
+                logging.error("Failed to get data from docker: %s: %s",
+                              addr, repr(ex))
+                continue
+
+            # The host is alive but slow, so keep its last known inventory
+            logging.error("Timed out accessing docker node: %s", addr)
+            if consul_host in global_env.containers:
+                containers[consul_host] = global_env.containers[consul_host]
+            if consul_host in global_env.docker_info:
+                docker_info[consul_host] = global_env.docker_info[consul_host]
+
+        cls.publish(docker_statuses=docker_statuses,
+                    containers=containers,
+                    docker_info=docker_info)
+
+        cls.update_event_watchers(hosts)
+
+    @classmethod
+    def update_event_watchers(cls, hosts):
+        """
+        Follows docker events of every passing host, and stops following
+        the ones that went away or became critical.
+        """
+        for addr, consul_host in hosts.items():
+            if global_env.docker_statuses.get(addr, None) != 'passing':
+                continue
+            if addr in cls.event_watchers:
+                continue
+
+            watcher = DockerEventWatcher(addr, consul_host)
+            cls.event_watchers[addr] = watcher
+            watcher.start()
+
+        for addr in list(cls.event_watchers):
+            if addr not in hosts or \
+               global_env.docker_statuses.get(addr, None) != 'passing':
+                cls.event_watchers.pop(addr).stop()
+
+    @classmethod
+    def refresh_group(cls, group_id, min_generation=None):
+        """
+        Brings a single group up to date after a change to it. Callers
+        that refresh the same group at the same time share one read,
+        which starts after all of them called, so each of them sees its
+        own change, and reads of a group never overlap. Reads of
+        different groups do run concurrently.
+
+        Nothing is read if the state is already at 'min_generation' or
+        newer. Returns the generation published afterwards.
+        """
+        if min_generation is not None and \
+           global_env.generation >= min_generation:
+            return global_env.generation
+
+        cls.flights.run(('group', group_id), cls.read_group, group_id,
+                        since=time.time())
+        return global_env.generation
+
+    @classmethod
+    def read_group(cls, group_id):
+        """
+        Re-reads KV, service entries and containers of a single group
+        and merges them into the current state. Only the nodes and
+        docker hosts the group lives on are asked, so this is much
+        cheaper than a rescan of the whole cluster.
+        """
+        consul_obj = consul_pool.get_client()
+
+        def belongs_to_group(instance_id):
+            return instance_id.split('_')[0] == group_id
+
+        old_allocation = cls.snapshot().allocations.get(group_id,
+                                                        {'instances': {}})
+
+        index, kv = consul_obj.kv.get('tarantool/%s/' % group_id,
+                                      recurse=True)
+        cls.merge_group_kv(group_id, index, kv or [])
+
+        # This is either what was just read or something newer
+        snapshot = cls.snapshot()
+        blueprint = snapshot.blueprints.get(group_id, None)
+        allocation = snapshot.allocations.get(group_id, {'instances': {}})
+
+        hosts = set()
+        for instance in list(allocation['instances'].values()) + \
+                list(old_allocation['instances'].values()):
+            hosts.add(instance['host'])
+        for instance in cls.containers().get(group_id,
+                                             {'instances': {}})['instances'].values():
+            hosts.add(instance['host'])
+        for entries in global_env.services.values():
+            for entry in entries:
+                if belongs_to_group(entry.id):
+                    hosts.add(entry.node_addr)
+
+        group_entries = []
+        if blueprint is not None:
+            node_names = {node.addr: node.name for node in global_env.nodes}
+            for host in sorted(hosts):
+                node_name = node_names.get(host, None)
+                if node_name is None:
+                    continue
+                catalog_node = consul_obj.catalog.node(node_name)[1]
+                checks = consul_obj.health.node(node_name)[1]
+                group_entries += [
+                    e for e in project_node_services(catalog_node, checks)
+                    if belongs_to_group(e.id)]
+
+        # Merge only after all requests are done, so that nothing that
+        # was published meanwhile is overwritten
+        services = dict(global_env.services)
+        for service_name, entries in services.items():
+            services[service_name] = [
+                e for e in entries if not belongs_to_group(e.id)]
+        for entry in group_entries:
+            services.setdefault(entry.service, []).append(entry)
+        cls.publish(services=services)
+
+        addrs = {}
+        for entry in global_env.services.get('docker', []):
+            consul_host = entry.node_addr
+            if consul_host not in hosts and entry.addr not in hosts:
+                continue
+
+            addr = entry.addr
+            if entry.port:
+                addr = addr + ':' + str(entry.port)
+
+            if global_env.docker_statuses.get(addr, None) != 'passing':
+                continue
+
+            cls.schedule.expedite(addr)
+            addrs[addr] = consul_host
+
+        def poll(addr):
+            docker_obj = docker_pool.get_client(addr,
+                                                timeout=DOCKER_API_TIMEOUT)
+            return project_containers(docker_obj.containers(
+                all=True, filters={'name': group_id + '_'}))
+
+        results, errors = poll_docker_hosts(addrs, poll)
+
+        # Whether the host is down is for the next sweep to decide, and
+        # until then it keeps its last known containers
+        for addr, ex in errors.items():
+            logging.error("Failed to refresh containers of group %s on %s: %s",
+                          group_id, addr, repr(ex))
+
+        containers = dict(global_env.containers)
+        for addr, host_containers in results.items():
+            consul_host = addrs[addr]
+            containers[consul_host] = [
+                c for c in containers.get(consul_host, [])
+                if not belongs_to_group(c.name)] + [
+                c for c in host_containers if belongs_to_group(c.name)]
+        cls.publish(containers=containers)
+
+    @classmethod
+    def merge_group_kv(cls, group_id, index, kv):
+        """
+        Merges KV of a single group, read at X-Consul-Index 'index', into
+        the snapshot, unless the same or newer data is already there.
+        Until the 'tarantool/' watcher gets to 'index', apply_kv() keeps
+        this data instead of the older one the watcher brings.
+        """
+        index = int(index)
+
+        watcher = cls.watchers.get('tarantool/', None)
+        if watcher is not None and watcher.index is not None and \
+           int(watcher.index) >= index:
+            return
+
+        held = cls.held_groups.get(group_id, None)
+        if held is not None and held[0] >= index:
+            return
+
+        cls.held_groups[group_id] = (index, time.time())
+
+        blueprints, allocations = parse_groups(kv)
+        snapshot = cls.snapshot()
+
+        new_blueprints = dict(snapshot.blueprints)
+        new_blueprints.pop(group_id, None)
+        new_blueprints.update(blueprints)
+        new_allocations = dict(snapshot.allocations)
+        new_allocations.pop(group_id, None)
+        new_allocations.update(allocations)
+
+        cls.publish(snapshot=snapshot.replace(blueprints=new_blueprints,
+                                              allocations=new_allocations))
+
+    @classmethod
+    def hold_refreshed_groups(cls, blueprints, allocations):
+        """
+        Puts groups that merge_group_kv() got at a newer index than the
+        'tarantool/' watcher has back into 'blueprints' and
+        'allocations', which the watcher has just parsed.
+        """
+        watcher = cls.watchers.get('tarantool/', None)
+        index = watcher.index if watcher is not None else None
+        snapshot = cls.snapshot()
+        now = time.time()
+
+        for group_id, (held_index, held_time) in list(cls.held_groups.items()):
+            # A watcher that was reset may stay behind for a long time
+            if index is None or int(index) >= held_index or \
+               now - held_time > KV_REFRESH_HOLD_TIME:
+                del cls.held_groups[group_id]
+                continue
+
+            for current, new in ((snapshot.blueprints, blueprints),
+                                 (snapshot.allocations, allocations)):
+                new.pop(group_id, None)
+                if group_id in current:
+                    new[group_id] = current[group_id]
+
+    @classmethod
+    def refresh_backup(cls, backup_id, min_generation=None):
+        """
+        Brings a single backup up to date after a change to it, sharing
+        reads and honoring 'min_generation' the same way refresh_group()
+        does.
+        """
+        if min_generation is not None and \
+           global_env.generation >= min_generation:
+            return global_env.generation
+
+        cls.flights.run(('backup', backup_id), cls.read_backup, backup_id,
+                        since=time.time())
+        return global_env.generation
+
+    @classmethod
+    def read_backup(cls, backup_id):
+        """
+        Re-reads a single backup from KV and merges it into the current
+        state.
+        """
+        consul_obj = consul_pool.get_client()
+
+        kv = consul_obj.kv.get('tarantool_backups/%s/' % backup_id,
+                               recurse=True)[1] or []
+
+        snapshot = cls.snapshot()
+        backups = dict(snapshot.backups)
+        backups.pop(backup_id, None)
+        backups.update(parse_backups(kv))
+        cls.publish(snapshot=snapshot.replace(backups=backups))
+
+    @classmethod
+    def apply_kv(cls, kv):
+        kv = kv or []
+        blueprints, allocations = parse_groups(kv)
+        cls.hold_refreshed_groups(blueprints, allocations)
+        cls.publish(kv=kv,
+                    snapshot=cls.snapshot().replace(blueprints=blueprints,
+                                                    allocations=allocations))
+
+    @classmethod
+    def apply_settings(cls, settings):
+        settings = settings or []
+        cls.publish(settings=settings,
+                    snapshot=cls.snapshot().replace(
+                        settings=parse_settings(settings)))
+
+    @classmethod
+    def apply_backups(cls, backups):
+        backups = backups or []
+        cls.publish(backups=backups,
+                    snapshot=cls.snapshot().replace(
+                        backups=parse_backups(backups)))
+
+    @classmethod
+    def apply_nodes(cls, nodes):
+        cls.publish(nodes=project_nodes(nodes))
+
+    @classmethod
+    def apply_service_names(cls, catalog_services):
+        service_names = watched_service_names(catalog_services)
+
+        for service_name in service_names - set(cls.service_watchers):
+            def apply(entries, service_name=service_name):
+                cls.service_catalog = dict(cls.service_catalog)
+                cls.service_catalog[service_name] = entries or []
+                cls.apply_services()
+
+            watcher = ConsulWatcher('catalog/service/' + service_name,
+                                    watch_catalog_service(service_name),
+                                    apply)
+            cls.service_watchers[service_name] = watcher
+            watcher.start()
+
+        removed = set(cls.service_watchers) - service_names
+        for service_name in removed:
+            cls.service_watchers.pop(service_name).stop()
+
+        if removed:
+            cls.service_catalog = {name: entries for name, entries
+                                   in cls.service_catalog.items()
+                                   if name not in removed}
+            cls.apply_services()
+
+    @classmethod
+    def apply_health_state(cls, checks):
+        cls.health_checks = checks or []
+        cls.apply_services()
+
+    @classmethod
+    def apply_services(cls):
+        # Until the first sweep of checks arrives, every service would
+        # look healthy
+        if cls.health_checks is None:
+            return
+
+        services = join_services(cls.service_catalog, cls.health_checks)
+
+        # Services whose catalog entries haven't arrived yet keep what
+        # is already known about them
+        for service_name in cls.service_watchers:
+            if service_name not in services and \
+               service_name in global_env.services:
+                services[service_name] = global_env.services[service_name]
+
+        cls.publish(services=services)
+
+    @classmethod
+    def watch(cls):
+        """
+        Starts long-lived blocking queries that keep global_env in
+        sync with Consul. New data arrives as soon as it changes, and
+        no requests are made while nothing changes.
+        """
+        watchers = [
+            ConsulWatcher('tarantool/', watch_kv('tarantool/'),
+                          cls.apply_kv),
+            ConsulWatcher('tarantool_settings/',
+                          watch_kv('tarantool_settings/'),
+                          cls.apply_settings),
+            ConsulWatcher('tarantool_backups/',
+                          watch_kv('tarantool_backups/'),
+                          cls.apply_backups),
+            ConsulWatcher('catalog/services', watch_catalog_services,
+                          cls.apply_service_names),
+            ConsulWatcher('health/state/any', watch_health_state,
+                          cls.apply_health_state),
+            ConsulWatcher('catalog/nodes', watch_catalog_nodes,
+                          cls.apply_nodes)
+        ]
+
+        for watcher in watchers:
+            cls.watchers[watcher.name] = watcher
+            watcher.start()
+
+        return watchers
+
+    @classmethod
+    def snapshot(cls):
+        return global_env.snapshot or EMPTY_SNAPSHOT
+
+    @classmethod
+    def state(cls):
+        """
+        Returns the State of the current generation. Callers that need
+        a consistent view across several reads should hold on to it
+        instead of calling Sense again.
+        """
+        state = cls.current_state
+        if state is None or state.generation != global_env.generation:
+            state = State()
+            cls.current_state = state
+        return state
+
+    @classmethod
+    def blueprints(cls):
+        return cls.state().blueprints()
+
+    @classmethod
+    def blueprint(cls, group_id):
+        return cls.state().blueprint(group_id)
+
+    @classmethod
+    def allocations(cls):
+        return cls.state().allocations()
+
+    @classmethod
+    def allocation(cls, group_id):
+        return cls.state().allocation(group_id)
+
+    @classmethod
+    def backups(cls):
+        return cls.state().backups()
+
+    @classmethod
+    def backup(cls, backup_id):
+        return cls.state().backup(backup_id)
+
+    @classmethod
+    def services(cls):
+        return cls.state().services()
+
+    @classmethod
+    def containers(cls):
+        return cls.state().containers()
+
+    @classmethod
+    def docker_hosts(cls):
+        return cls.state().docker_hosts()
+
+    @classmethod
+    def docker_host_index(cls):
+        return cls.state().docker_host_index()
+
+    @classmethod
+    def resolve_docker_host(cls, host):
+        return cls.state().resolve_docker_host(host)
+
+    @classmethod
+    def network_settings(cls):
+        return cls.state().network_settings()
+
+    @classmethod
+    def consul_hosts(cls):
+        return cls.state().consul_hosts()
 
     @classmethod
     def timer_update(cls):
-        gevent.spawn(cls.docker_status_update)
+        saved_generation = None
+        saved_time = 0
+        if global_env.snapshot_file:
+            if cls.load_snapshot(global_env.snapshot_file):
+                saved_generation = global_env.generation
 
+        cls.watch()
+
+        # Every tick polls only the docker hosts that are due, see
+        # PollSchedule
         while True:
             try:
-                cls.update()
-                time.sleep(10)
-            except consul.base.ConsulException as ex:
-                if "No cluster leader" in str(ex):
-                    logging.warn(
-                        "Won't update consul status: no consul leader")
-                    continue
-                else:
-                    logging.exception("Failed to update data from consul")
-                    time.sleep(10)
-            except Exception as ex:
-                logging.exception("Failed to update data from consul")
-                time.sleep(10)
+                with metrics.measure('sweep:docker'):
+                    cls.flights.run('docker', cls.update_docker)
+            except Exception:
+                logging.exception("Failed to update data from docker")
+                time.sleep(DOCKER_POLL_INTERVAL)
+                continue
+
+            if global_env.snapshot_file and \
+               global_env.generation != saved_generation and \
+               time.time() - saved_time >= SNAPSHOT_SAVE_INTERVAL:
+                # retried on the next tick if it fails
+                saved_time = time.time()
+                try:
+                    cls.save_snapshot(global_env.snapshot_file)
+                    saved_generation = global_env.generation
+                except Exception:
+                    logging.exception("Failed to save snapshot to %s",
+                                      global_env.snapshot_file)
+
+            time.sleep(DOCKER_POLL_TICK)
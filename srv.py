@@ -6,7 +6,9 @@ monkey.patch_all()
 
 import os
 import sys
+import time
 import uuid
+import functools
 import ipaddress
 import memcached
 import tarantino
@@ -14,13 +16,19 @@ import tarantool
 import sense
 import global_env
 import logging
-import consul
+import consul_pool
+import docker_pool
+import metrics
+import listing
+import events
+import json
 import docker
 import argparse
 import yaml
 import ip_pool
 import backup_storage
 import task
+import journal
 
 import werkzeug
 
@@ -28,7 +36,7 @@ from gevent.wsgi import WSGIServer
 import flask
 from flask import Flask
 from flask import Response
-from flask_restful import reqparse, abort, Api, Resource
+from flask_restful import reqparse, abort, inputs, Api, Resource
 from flask_bootstrap import Bootstrap
 from flask_basicauth import BasicAuth
 
@@ -38,7 +46,18 @@ api = Api(app)
 Bootstrap(app)
 BasicAuth(app)
 
-TASKS = {}
+TASKS = task.TaskStore()
+
+# Generations start from 0 on every start, so ETags carry a token of
+# the process as well
+ETAG_EPOCH = uuid.uuid4().hex[:8]
+
+BLOCKING_QUERY_TIMEOUT = 300 # seconds
+BLOCKING_QUERY_MAX_TIMEOUT = 600 # seconds
+
+# an idle event stream gets a keep-alive line this often, so that
+# proxies don't drop it
+EVENT_KEEPALIVE_INTERVAL = 15 # seconds
 
 def abort_if_group_doesnt_exist(group_id):
     if group_id not in sense.Sense.blueprints():
@@ -60,6 +79,66 @@ def abort_if_backup_doesnt_exist(backup_id):
         abort(404, message="backup {} doesn't exist".format(backup_id))
 
 
+def generation_etag():
+    return '%s-%d' % (ETAG_EPOCH, global_env.generation)
+
+
+def conditional_get(func):
+    """
+    Tags the response with the generation of the Sense state, and
+    answers 304 Not Modified without building the response if the
+    client already has the one for the current generation.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        etag = generation_etag()
+
+        index = str(global_env.generation)
+
+        if flask.request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['X-Cloud-Index'] = index
+            return response
+
+        result = func(*args, **kwargs)
+        headers = {'ETag': '"%s"' % etag, 'X-Cloud-Index': index}
+
+        # listings may return headers of their own
+        if isinstance(result, tuple):
+            result, extra_headers = result
+            headers.update(extra_headers)
+
+        return result, 200, headers
+
+    return wrapper
+
+
+def blocking_get(func):
+    """
+    With '?wait_index=N', holds the request until the state generation
+    is past N, or for '&timeout=T' seconds, the same way Consul blocking
+    queries do. The generation a response was built from is returned in
+    the X-Cloud-Index header. An N from before a restart, which is ahead
+    of the current generation, is answered right away.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('wait_index', type=int, location='args')
+        parser.add_argument('timeout', type=int, location='args',
+                            default=BLOCKING_QUERY_TIMEOUT)
+        query = parser.parse_args()
+
+        if query['wait_index'] is not None:
+            timeout = min(max(query['timeout'], 0), BLOCKING_QUERY_MAX_TIMEOUT)
+            sense.Sense.wait_for_generation(query['wait_index'], timeout)
+
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
 def state_to_dict(state_name):
     if state_name == 'passing':
         return {'id': '1', 'name': 'OK', 'type': 'passing'}
@@ -70,110 +149,239 @@ def state_to_dict(state_name):
 
     raise RuntimeError("No such state: '%s'" % state_name)
 
-def instance_to_dict(instance_id):
-    group_id, instance_num = instance_id.split('_')
+def isoformat(value):
+    return value.isoformat() if value is not None else None
 
-    memc = memcached.Memcached.get(group_id)
-    blueprint = memc.blueprint
-    allocation = memc.allocation
-    services = memc.services
-
-    addr = blueprint['instances'][instance_num]['addr']
-    host = allocation['instances'][instance_num]['host']
-    type_str = blueprint['type']
-    name = instance_num
-    instance_id = group_id + '_' + instance_num
-    state = services['instances'][instance_num]['status']
-    port = services['instances'][instance_num]['port']
-    mem_used = services['instances'][instance_num]['mem_used']
-
-    return {'id': instance_id,
-            'name': name,
-            'addr': addr,
-            'port': port,
-            'type': type_str,
-            'host': host,
-            'state': state_to_dict(state),
-            'mem_used': mem_used}
-
-
-def backup_to_dict(backup_id):
-    backups = sense.Sense.backups()
 
-    backup = backups[backup_id]
+def serialize_group(state, group_id, blueprint):
+    """
+    Builds the /api/groups entry of a group and the /api/instances
+    entries of its instances from 'state'.
+    """
+    no_instances = {'instances': {}}
+    services = state.services().get(group_id, no_instances)['instances']
+    containers = state.containers().get(group_id, no_instances)['instances']
+    allocation = state.allocations().get(group_id, no_instances)['instances']
 
-    return {'id': backup_id,
-            'archive_id': backup['archive_id'],
-            'group_id': backup['group_id'],
-            'type': backup['type'],
-            'creation_time': backup['creation_time'].isoformat(),
-            'size': backup['size'],
-            'mem_used': backup['mem_used'],
-            'storage': backup['storage']}
+    type_str = blueprint.get('type', None)
 
+    instances = {}
+    group_instances = []
 
-def group_to_dict(group_id):
-    memc = memcached.Memcached.get(group_id)
-    blueprint = memc.blueprint
-    allocation = memc.allocation
-    services = memc.services
-    containers = sense.Sense.containers().get(group_id,
-                                              {'instances': {}})
-
-    state = 'passing'
-
-    states = [i['status'] for i in services['instances'].values()]
-    state = sense.combine_consul_statuses(states)
-
-    instances = []
-
-    for instance_num in blueprint['instances']:
-        addr = blueprint['instances'][instance_num]['addr']
-
-        type_str = blueprint['type']
+    for instance_num in blueprint.get('instances', {}):
+        addr = blueprint['instances'][instance_num].get('addr', None)
         name = instance_num
         instance_id = group_id + '_' + instance_num
 
-        if instance_num in allocation['instances']:
-            host = allocation['instances'][instance_num]['host']
+        if instance_num in allocation:
+            host = allocation[instance_num]['host']
         else:
             host = "N/A"
 
-        if instance_num in services['instances']:
-            instance_state = services['instances'][instance_num]['status']
-            port = services['instances'][instance_num]['port']
-            mem_used = services['instances'][instance_num]['mem_used']
+        if instance_num in services:
+            instance_state = services[instance_num]['status']
+            port = services[instance_num]['port']
+            mem_used = services[instance_num]['mem_used']
         else:
             instance_state = 'critical'
             port = None
             mem_used = None
 
+        state_dict = state_to_dict(instance_state)
+
         image_name = None
         image_id = None
-        if instance_num in containers['instances']:
-            image_name = containers['instances'][instance_num]['docker_image_name']
-            image_id = containers['instances'][instance_num]['docker_image_id']
-
-        instances.append({'id': instance_id,
-                          'name': name,
-                          'addr': addr,
-                          'port': port,
-                          'type': type_str,
-                          'host': host,
-                          'state': state_to_dict(instance_state),
-                          'docker_image_name': image_name,
-                          'docker_image_id': image_id,
-                          'mem_used': mem_used})
-
-    result = {'name': blueprint['name'],
-              'id': group_id,
-              'memsize': blueprint['memsize'],
-              'type': blueprint['type'],
-              'creation_time': blueprint['creation_time'].isoformat(),
-              'state': state_to_dict(state),
-              'instances': instances}
-
-    return result
+        if instance_num in containers:
+            image_name = containers[instance_num]['docker_image_name']
+            image_id = containers[instance_num]['docker_image_id']
+
+        instances[instance_id] = {'id': instance_id,
+                                  'name': name,
+                                  'addr': addr,
+                                  'port': port,
+                                  'type': type_str,
+                                  'host': host,
+                                  'state': state_dict,
+                                  'mem_used': mem_used}
+
+        group_instances.append({'id': instance_id,
+                                'name': name,
+                                'addr': addr,
+                                'port': port,
+                                'type': type_str,
+                                'host': host,
+                                'state': state_dict,
+                                'docker_image_name': image_name,
+                                'docker_image_id': image_id,
+                                'mem_used': mem_used})
+
+    states = [i['status'] for i in services.values()]
+    state_name = sense.combine_consul_statuses(states)
+
+    group = {'name': blueprint.get('name', None),
+             'id': group_id,
+             'memsize': blueprint.get('memsize', None),
+             'type': type_str,
+             'creation_time': isoformat(blueprint.get('creation_time', None)),
+             'state': state_to_dict(state_name),
+             'instances': group_instances}
+
+    return group, instances
+
+
+@sense.memoized_view
+def serialized_groups(state):
+    """
+    Serializes every group and instance in one pass over 'state'.
+    Returns (groups, instances) keyed by group and instance id. The
+    result is cached in the state, so it must not be modified.
+    """
+    groups = {}
+    instances = {}
+
+    for group_id, blueprint in state.blueprints().items():
+        groups[group_id], group_instances = \
+            serialize_group(state, group_id, blueprint)
+        instances.update(group_instances)
+
+    return groups, instances
+
+
+def instance_to_dict(instance_id):
+    group_id = instance_id.split('_')[0]
+    state = sense.Sense.state()
+
+    _, instances = serialize_group(state, group_id,
+                                   state.blueprint(group_id))
+    return instances[instance_id]
+
+
+def serialize_backup(backup_id, backup):
+    return {'id': backup_id,
+            'archive_id': backup.get('archive_id', None),
+            'group_id': backup.get('group_id', None),
+            'type': backup.get('type', None),
+            'creation_time': isoformat(backup.get('creation_time', None)),
+            'size': backup.get('size', None),
+            'mem_used': backup.get('mem_used', None),
+            'storage': backup.get('storage', None)}
+
+
+def backup_to_dict(backup_id):
+    return serialize_backup(backup_id, sense.Sense.backup(backup_id))
+
+
+def group_to_dict(group_id):
+    state = sense.Sense.state()
+
+    group, _ = serialize_group(state, group_id, state.blueprint(group_id))
+    return group
+
+
+@sense.memoized_view
+def group_catalog(state):
+    groups, _ = serialized_groups(state)
+    blueprints = state.blueprints()
+    allocations = state.allocations()
+
+    def hosts(group_id):
+        allocation = allocations.get(group_id, {'instances': {}})
+        return [i['host'] for i in allocation['instances'].values()]
+
+    return listing.Catalog(
+        groups,
+        exact={'type': lambda i: [groups[i]['type']],
+               'state': lambda i: [groups[i]['state']['type']],
+               'host': hosts},
+        ordered={'name': lambda i: groups[i]['name'],
+                 'creation_time': lambda i: listing.as_utc(
+                     blueprints[i].get('creation_time', None))})
+
+
+@sense.memoized_view
+def instance_catalog(state):
+    _, instances = serialized_groups(state)
+    blueprints = state.blueprints()
+
+    def group_id(instance_id):
+        return instance_id.split('_')[0]
+
+    return listing.Catalog(
+        instances,
+        exact={'type': lambda i: [instances[i]['type']],
+               'state': lambda i: [instances[i]['state']['type']],
+               'host': lambda i: [instances[i]['host']],
+               'group_id': lambda i: [group_id(i)]},
+        ordered={'name': lambda i: instances[i]['name'],
+                 'creation_time': lambda i: listing.as_utc(
+                     blueprints[group_id(i)].get('creation_time', None))})
+
+
+@sense.memoized_view
+def backup_catalog(state):
+    backups = state.backups()
+    entries = {backup_id: serialize_backup(backup_id, backup)
+               for backup_id, backup in backups.items()}
+
+    return listing.Catalog(
+        entries,
+        exact={'type': lambda i: [entries[i]['type']],
+               'group_id': lambda i: [entries[i]['group_id']],
+               'storage': lambda i: [entries[i]['storage']]},
+        ordered={'creation_time': lambda i: listing.as_utc(
+            backups[i].get('creation_time', None))})
+
+
+def query_catalog(catalog):
+    """
+    Answers a listing request from 'catalog', a listing.Catalog or
+    anything that can be queried the same way. Every exact filter of the
+    catalog is a query argument, '?name=' selects entries by prefix of
+    their name and '?created_after=' by creation time. '?limit=N'
+    splits the result into pages, and the cursor of the next one is
+    returned in the X-Cloud-Next-Cursor header, to be passed back as
+    '?cursor='. '?fields=a,b' leaves only these fields in the entries.
+    Returns the result and the headers to add to the response.
+    """
+    parser = reqparse.RequestParser(bundle_errors=True)
+    for name in catalog.exact:
+        parser.add_argument(name, location='args')
+    if 'name' in catalog.ordered:
+        parser.add_argument('name', location='args')
+    if 'creation_time' in catalog.ordered:
+        parser.add_argument('created_after',
+                            type=inputs.datetime_from_iso8601,
+                            location='args')
+    parser.add_argument('cursor', location='args')
+    parser.add_argument('limit', type=inputs.positive, location='args')
+    parser.add_argument('fields', location='args')
+    query = parser.parse_args()
+
+    exact = {name: query[name] for name in catalog.exact
+             if query[name] is not None}
+
+    prefix = {}
+    if query.get('name') is not None:
+        prefix['name'] = query['name']
+
+    after = {}
+    if query.get('created_after') is not None:
+        after['creation_time'] = listing.as_utc(query['created_after'])
+
+    ids, next_cursor = catalog.query(exact, prefix, after,
+                                     query['cursor'], query['limit'])
+
+    fields = [f for f in (query['fields'] or '').split(',') if f]
+
+    result = {}
+    for entry_id in ids:
+        result[entry_id] = listing.project(catalog.entry(entry_id), fields)
+
+    headers = {}
+    if next_cursor is not None:
+        headers['X-Cloud-Next-Cursor'] = next_cursor
+
+    return result, headers
 
 
 class UpdateImagesTask(task.Task):
@@ -207,19 +415,19 @@ class Group(Resource):
 
         if group['type'] == 'memcached':
             delete_task = memcached.DeleteTask(group_id)
-            TASKS[delete_task.task_id] = delete_task
+            TASKS.add(delete_task)
 
             memc = memcached.Memcached.get(group_id)
             gevent.spawn(memc.delete, delete_task)
         elif group['type'] == 'tarantino':
             delete_task = tarantino.DeleteTask(group_id)
-            TASKS[delete_task.task_id] = delete_task
+            TASKS.add(delete_task)
 
             tar = tarantino.Tarantino.get(group_id)
             gevent.spawn(tar.delete, delete_task)
         elif group['type'] == 'tarantool':
             delete_task = tarantool.DeleteTask(group_id)
-            TASKS[delete_task.task_id] = delete_task
+            TASKS.add(delete_task)
 
             tar = tarantool.Tarantool.get(group_id)
             gevent.spawn(tar.delete, delete_task)
@@ -261,7 +469,7 @@ class Group(Resource):
             memc = memcached.Memcached.get(group_id)
 
             update_task = memcached.UpdateTask(group_id)
-            TASKS[update_task.task_id] = update_task
+            TASKS.add(update_task)
 
             gevent.spawn(memc.update,
                          args['name'],
@@ -277,7 +485,7 @@ class Group(Resource):
             tar = tarantino.Tarantino.get(group_id)
 
             update_task = tarantino.UpdateTask(group_id)
-            TASKS[update_task.task_id] = update_task
+            TASKS.add(update_task)
 
             config_data = None
             if args['config']:
@@ -295,7 +503,7 @@ class Group(Resource):
             tar = tarantool.Tarantool.get(group_id)
 
             update_task = tarantool.UpdateTask(group_id)
-            TASKS[update_task.task_id] = update_task
+            TASKS.add(update_task)
 
             config_data = None
             config_filename = None
@@ -329,13 +537,10 @@ class Group(Resource):
 
 
 class GroupList(Resource):
+    @blocking_get
+    @conditional_get
     def get(self):
-        blueprints = sense.Sense.blueprints()
-
-        result = {}
-        for group_id in blueprints:
-            result[group_id] = group_to_dict(group_id)
-        return result
+        return query_catalog(group_catalog(sense.Sense.state()))
 
     def post(self):
         parser = reqparse.RequestParser(bundle_errors=True)
@@ -355,7 +560,7 @@ class GroupList(Resource):
 
         if args['type'] == 'memcached':
             create_task = memcached.CreateTask(group_id)
-            TASKS[create_task.task_id] = create_task
+            TASKS.add(create_task)
 
             gevent.spawn(memcached.Memcached.create,
                          create_task,
@@ -365,7 +570,7 @@ class GroupList(Resource):
                          10)
         elif args['type'] == 'tarantino':
             create_task = tarantino.CreateTask(group_id)
-            TASKS[create_task.task_id] = create_task
+            TASKS.add(create_task)
 
             gevent.spawn(tarantino.Tarantino.create,
                          create_task,
@@ -375,7 +580,7 @@ class GroupList(Resource):
                          10)
         elif args['type'] == 'tarantool':
             create_task = tarantool.CreateTask(group_id)
-            TASKS[create_task.task_id] = create_task
+            TASKS.add(create_task)
             gevent.spawn(tarantool.Tarantool.create,
                          create_task,
                          args['name'],
@@ -403,27 +608,24 @@ class Task(Resource):
 
         args = parser.parse_args()
 
-        if task_id not in TASKS:
+        task_obj = TASKS.get(task_id)
+        if task_obj is None:
             abort(404, message="task {} doesn't exist".format(task_id))
 
         if args['index']:
-            TASKS[task_id].wait(args['index'])
+            task_obj.wait(args['index'])
 
-        return TASKS[task_id].get_dict(args['index'])
+        return task_obj.get_dict(args['index'])
 
 
 class TaskList(Resource):
     def get(self):
-        result = {}
-
-        for task_id, task in TASKS.items():
-            result[task_id] = task.get_dict().copy()
-            del result[task_id]['logs']
-
-        return result
+        result, headers = query_catalog(TASKS)
+        return result, 200, headers
 
 
 class ServerList(Resource):
+    @conditional_get
     def get(self):
         result = {}
 
@@ -454,7 +656,7 @@ class Backup(Resource):
         abort_if_backup_doesnt_exist(backup_id)
 
         delete_task = backup_storage.DeleteTask(backup_id)
-        TASKS[delete_task.task_id] = delete_task
+        TASKS.add(delete_task)
 
         if not global_env.backup_storage:
             abort(500, message="Backup storage not configured")
@@ -498,14 +700,9 @@ class BackupData(Resource):
 
 
 class BackupList(Resource):
+    @conditional_get
     def get(self):
-        backups = sense.Sense.backups()
-
-        result = {}
-        for backup_id in backups.keys():
-            result[backup_id] = backup_to_dict(backup_id)
-
-        return result
+        return query_catalog(backup_catalog(sense.Sense.state()))
 
     def post(self):
         parser = reqparse.RequestParser(bundle_errors=True)
@@ -536,7 +733,7 @@ class BackupList(Resource):
         backup_id = uuid.uuid4().hex
 
         upload_task = backup_storage.UploadTask(backup_id)
-        TASKS[upload_task.task_id] = upload_task
+        TASKS.add(upload_task)
 
         def upload_backup(upload_task, storage, group_type, digest, total_size):
             backup_id = upload_task.backup_id
@@ -557,7 +754,7 @@ class BackupList(Resource):
                 storage.register_backup(backup_id, digest, group_id,
                                         group_type, total_size, 0)
 
-                sense.Sense.update()
+                sense.Sense.refresh_backup(backup_id)
                 upload_task.set_status(task.STATUS_SUCCESS)
             except Exception as ex:
                 logging.exception("Failed to upload backup '%s'", backup_id)
@@ -608,7 +805,7 @@ class InstanceBackupList(Resource):
 
         if group['type'] == 'memcached':
             backup_task = memcached.BackupTask(group_id, backup_id)
-            TASKS[backup_task.task_id] = backup_task
+            TASKS.add(backup_task)
             memc = memcached.Memcached.get(group_id)
 
             gevent.spawn(memc.backup,
@@ -616,7 +813,7 @@ class InstanceBackupList(Resource):
                          storage)
         elif group['type'] == 'tarantool':
             backup_task = memcached.BackupTask(group_id, backup_id)
-            TASKS[backup_task.task_id] = backup_task
+            TASKS.add(backup_task)
             tar = tarantool.Tarantool.get(group_id)
 
             gevent.spawn(tar.backup,
@@ -650,17 +847,10 @@ class Instance(Resource):
 
 
 class InstanceList(Resource):
+    @blocking_get
+    @conditional_get
     def get(self):
-        instances = {}
-
-        result = {}
-        for group_id, group in sense.Sense.blueprints().items():
-            for instance_num in group['instances']:
-                instance_id = group_id + '_' + instance_num
-
-                result[instance_id] = instance_to_dict(instance_id)
-
-        return result
+        return query_catalog(instance_catalog(sense.Sense.state()))
 
 
 def update_images(update_task):
@@ -690,7 +880,7 @@ class UpdateImages(Resource):
         args = parser.parse_args()
 
         update_task = UpdateImagesTask()
-        TASKS[update_task.task_id] = update_task
+        TASKS.add(update_task)
         gevent.spawn(update_images, update_task)
 
         if args['async']:
@@ -702,6 +892,198 @@ class UpdateImages(Resource):
             return {}, 201
 
 
+class SenseDebug(Resource):
+    def get(self):
+        sources = metrics.stats()
+        ages = [source['age'] for source in sources.values()
+                if source['age'] is not None]
+
+        return {'generation': global_env.generation,
+                'stale': sense.Sense.is_stale(),
+                'max_source_age': max(ages) if ages else None,
+                'sources': sources,
+                'views': sense.Sense.view_stats()['views'],
+                'docker_schedule': sense.Sense.schedule.to_dict(),
+                'consul_requests': consul_pool.stats(),
+                'docker_clients': docker_pool.stats(),
+                'tasks': TASKS.stats()}
+
+
+class EventStream(Resource):
+    """
+    Streams events as newline-delimited JSON, or as Server-Sent Events
+    if the client accepts text/event-stream. Only events after
+    '?index=N' (or Last-Event-ID) are sent, and they may be limited to
+    one group with '?group_id=' and to some types with '?type='.
+    """
+    def get(self):
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('group_id', location='args')
+        parser.add_argument('type', location='args', action='append',
+                            choices=events.EVENT_TYPES)
+        parser.add_argument('index', type=int, location='args')
+        parser.add_argument('Last-Event-ID', type=int, location='headers',
+                            dest='last_event_id')
+        args = parser.parse_args()
+
+        index = args['index']
+        if index is None:
+            index = args['last_event_id']
+        if index is None:
+            index = events.LOG.index
+
+        group_id = args['group_id']
+        types = set(args['type'] or [])
+
+        sse = flask.request.accept_mimetypes.best == 'text/event-stream'
+
+        def format_event(event):
+            if sse:
+                return 'id: %d\ndata: %s\n\n' % (event['index'],
+                                                 json.dumps(event))
+            return json.dumps(event) + '\n'
+
+        def stream_events(index):
+            keepalive = ': keepalive\n\n' if sse else '\n'
+            last_sent = time.time()
+
+            while True:
+                chunk = []
+
+                # Indexes start over when the server restarts, and old
+                # events are pushed out of the log. Either way the
+                # client has missed something and should reload.
+                first_index = events.LOG.first_index()
+                if index > events.LOG.index or first_index > index + 1:
+                    chunk.append(format_event(
+                        {'index': first_index - 1,
+                         'type': 'dropped',
+                         'group_id': None}))
+                    index = min(index, first_index - 1)
+
+                batch = events.LOG.since(index)
+                for event in batch:
+                    if events.matches(event, group_id, types):
+                        chunk.append(format_event(event))
+
+                if batch:
+                    index = batch[-1]['index']
+
+                if chunk:
+                    yield ''.join(chunk)
+                    last_sent = time.time()
+                elif time.time() - last_sent >= EVENT_KEEPALIVE_INTERVAL:
+                    yield keepalive
+                    last_sent = time.time()
+
+                events.LOG.wait(index, EVENT_KEEPALIVE_INTERVAL)
+
+        mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+
+        return Response(stream_events(index),
+                        mimetype=mimetype,
+                        headers={'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+
+
+def prometheus_metrics():
+    lines = []
+
+    def add(name, value, labels=None):
+        if value is None:
+            return
+        if labels:
+            name += '{%s}' % ','.join(
+                '%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                             .replace('"', '\\"'))
+                for k, v in sorted(labels.items()))
+        lines.append('%s %s' % (name, value))
+
+    lines.append('# TYPE sense_generation gauge')
+    add('sense_generation', global_env.generation)
+    lines.append('# TYPE sense_stale gauge')
+    add('sense_stale', int(sense.Sense.is_stale()))
+
+    lines.append('# TYPE sense_refresh_duration_seconds histogram')
+    for name, stats in sorted(metrics.SOURCES.items()):
+        cumulative = 0
+        for bound, count in zip(metrics.LATENCY_BUCKETS, stats.buckets):
+            cumulative += count
+            add('sense_refresh_duration_seconds_bucket', cumulative,
+                {'source': name, 'le': bound})
+        add('sense_refresh_duration_seconds_bucket', stats.count,
+            {'source': name, 'le': '+Inf'})
+        add('sense_refresh_duration_seconds_sum', stats.total_time,
+            {'source': name})
+        add('sense_refresh_duration_seconds_count', stats.count,
+            {'source': name})
+
+    lines.append('# TYPE sense_refresh_contacts_total counter')
+    for name, stats in sorted(metrics.SOURCES.items()):
+        add('sense_refresh_contacts_total', stats.contacts, {'source': name})
+
+    lines.append('# TYPE sense_refresh_errors_total counter')
+    for name, stats in sorted(metrics.SOURCES.items()):
+        add('sense_refresh_errors_total', stats.errors, {'source': name})
+
+    lines.append('# TYPE sense_refresh_payload_items gauge')
+    for name, stats in sorted(metrics.SOURCES.items()):
+        add('sense_refresh_payload_items', stats.last_items, {'source': name})
+
+    lines.append('# TYPE sense_source_age_seconds gauge')
+    for name, stats in sorted(metrics.SOURCES.items()):
+        add('sense_source_age_seconds', stats.age(), {'source': name})
+
+    # Every family has to come as one group of lines
+    views = sorted(sense.Sense.view_stats()['views'].items())
+    for family, field in (('sense_view_cache_hits_total', 'hits'),
+                          ('sense_view_cache_misses_total', 'misses')):
+        lines.append('# TYPE %s counter' % family)
+        for name, stats in views:
+            add(family, stats[field], {'view': name})
+
+    endpoints = sorted(consul_pool.stats().items())
+    for family, field in (('consul_requests_total', 'count'),
+                          ('consul_request_errors_total', 'errors'),
+                          ('consul_request_duration_seconds_sum',
+                           'total_time')):
+        lines.append('# TYPE %s counter' % family)
+        for endpoint, stats in endpoints:
+            add(family, stats[field], {'endpoint': endpoint})
+
+    task_stats = TASKS.stats()
+    lines.append('# TYPE tasks gauge')
+    add('tasks', task_stats['running'], {'status': 'running'})
+    add('tasks', task_stats['completed'], {'status': 'completed'})
+    lines.append('# TYPE tasks_evicted_total counter')
+    add('tasks_evicted_total', task_stats['evicted'])
+    lines.append('# TYPE task_log_entries gauge')
+    add('task_log_entries', task_stats['log_entries'])
+    lines.append('# TYPE task_memory_bytes gauge')
+    add('task_memory_bytes', task_stats['memory_usage'])
+
+    lines.append('# TYPE docker_clients_total counter')
+    for name, value in sorted(docker_pool.stats()['clients'].items()):
+        add('docker_clients_total', value, {'event': name})
+
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(prometheus_metrics(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.after_request
+def mark_stale_response(response):
+    # Until the first refresh, data comes from the snapshot file and
+    # may be outdated
+    if sense.Sense.is_stale():
+        response.headers['X-Cloud-Stale'] = 'true'
+    return response
+
+
 def setup_routes():
     api.add_resource(GroupList, '/api/groups')
     api.add_resource(Group, '/api/groups/<group_id>')
@@ -727,6 +1109,10 @@ def setup_routes():
 
     api.add_resource(UpdateImages, '/api/update_images')
 
+    api.add_resource(SenseDebug, '/api/debug/sense')
+
+    api.add_resource(EventStream, '/api/events')
+
 
 @app.route('/servers')
 def list_servers():
@@ -757,16 +1143,17 @@ def list_servers():
 @app.route('/groups', methods=['GET'])
 @app.route('/', methods=['GET'])
 def list_groups():
-    blueprints = sense.Sense.blueprints()
-    services = sense.Sense.services()
+    state = sense.Sense.state()
+    groups, _ = serialized_groups(state)
+    services = state.services()
     result = {}
-    for group_id in blueprints:
-        result[group_id] = group_to_dict(group_id)
+    for group_id, group in groups.items():
         mem = 0
         if group_id in services:
             mem = max([i['mem_used']
                        for i in services[group_id]['instances'].values()])
-        result[group_id]['mem_used'] = mem
+        # the serialized groups are shared, so add to a copy
+        result[group_id] = dict(group, mem_used=mem)
 
     return flask.render_template('group_list.html', groups=result.values())
 
@@ -793,7 +1180,7 @@ def create_group():
 
     group_id = uuid.uuid4().hex
     create_task = memcached.CreateTask(group_id)
-    TASKS[create_task.task_id] = create_task
+    TASKS.add(create_task)
 
     memcached.Memcached.create(create_task, name, memsize, None, 10)
 
@@ -808,7 +1195,7 @@ def resize_group(group_id):
         return flask.redirect("/groups")
 
     update_task = memcached.UpdateTask(group_id)
-    TASKS[update_task.task_id] = update_task
+    TASKS.add(update_task)
 
     memc = memcached.Memcached.get(group_id)
     memc.resize(memsize, update_task)
@@ -827,8 +1214,7 @@ def delete_group(group_id):
 
 @app.route('/network', methods=['GET', 'POST'])
 def network_settings():
-    consul_obj = consul.Consul(host=global_env.consul_host,
-                               token=global_env.consul_acl_token)
+    consul_obj = consul_pool.get_client()
     kv = consul_obj.kv.get('tarantool_settings', recurse=True)[1] or []
     default = global_env.default_network_settings
     settings = {'network_name': None, 'subnet': None}
@@ -889,7 +1275,9 @@ def get_config(config_file):
             'CREATE_NETWORK_AUTOMATICALLY', 'GATEWAY_IP',
             'BACKUP_STORAGE_TYPE', 'BACKUP_BASE_DIR',
             'BACKUP_HOST', 'BACKUP_IDENTITY', 'BACKUP_USER',
-            'SSL_KEYFILE', 'SSL_CERTFILE']
+            'SSL_KEYFILE', 'SSL_CERTFILE', 'DOCKER_POLL_CONCURRENCY',
+            'SNAPSHOT_FILE', 'TASK_RETENTION_COUNT', 'TASK_RETENTION_AGE',
+            'TASK_LOG_SIZE', 'TASK_COMPLETED_LOG_SIZE', 'TASK_JOURNAL_DIR']
 
     for opt in opts:
         if opt in os.environ:
@@ -955,6 +1343,33 @@ def main():
     if 'CREATE_NETWORK_AUTOMATICALLY' in cfg:
         global_env.default_network_settings['create_automatically'] = True
 
+    if 'DOCKER_POLL_CONCURRENCY' in cfg:
+        global_env.docker_poll_concurrency = int(cfg['DOCKER_POLL_CONCURRENCY'])
+
+    if 'SNAPSHOT_FILE' in cfg:
+        global_env.snapshot_file = os.path.expanduser(cfg['SNAPSHOT_FILE'])
+
+    if 'TASK_RETENTION_COUNT' in cfg:
+        global_env.task_retention_count = int(cfg['TASK_RETENTION_COUNT'])
+
+    if 'TASK_RETENTION_AGE' in cfg:
+        global_env.task_retention_age = int(cfg['TASK_RETENTION_AGE'])
+
+    if 'TASK_LOG_SIZE' in cfg:
+        global_env.task_log_size = int(cfg['TASK_LOG_SIZE'])
+
+    if 'TASK_COMPLETED_LOG_SIZE' in cfg:
+        global_env.task_completed_log_size = \
+            int(cfg['TASK_COMPLETED_LOG_SIZE'])
+
+    for name in ('TASK_LOG_SIZE', 'TASK_COMPLETED_LOG_SIZE'):
+        if name in cfg and int(cfg[name]) < 0:
+            raise RuntimeError("%s can't be negative: %s" % (name, cfg[name]))
+
+    if 'TASK_JOURNAL_DIR' in cfg:
+        global_env.task_journal_dir = \
+            os.path.expanduser(cfg['TASK_JOURNAL_DIR'])
+
     if 'BACKUP_STORAGE_TYPE' in cfg:
         backup_config = {'base_dir': cfg.get('BACKUP_BASE_DIR', None),
                          'host': cfg.get('BACKUP_HOST', None),
@@ -978,9 +1393,13 @@ def main():
         )
     global_env.docker_tls_config = docker_tls_config
 
+    if global_env.task_journal_dir:
+        journal.open_journal(global_env.task_journal_dir, TASKS)
+
     setup_routes()
 
     gevent.spawn(sense.Sense.timer_update)
+    gevent.spawn(events.watch_states)
     gevent.spawn(ip_pool.ip_cache_invalidation_loop)
 
     if listen_addr.startswith('unix:/'):
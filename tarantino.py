@@ -2,12 +2,13 @@
 # pylint: disable=missing-super-argument
 import global_env
 import group
-import consul
+import consul_pool
 from sense import Sense
 import ip_pool
 import random
 import logging
 import docker
+import docker_pool
 import uuid
 import time
 import tarantool
@@ -73,8 +74,7 @@ class Tarantino(group.Group):
         group_id = create_task.group_id
 
         try:
-            consul_obj = consul.Consul(host=global_env.consul_host,
-                                       token=global_env.consul_acl_token)
+            consul_obj = consul_pool.get_client()
             kv = consul_obj.kv
 
             create_task.log("Creating group '%s'", group_id)
@@ -88,26 +88,27 @@ class Tarantino(group.Group):
             kv.put('tarantool/%s/blueprint/memsize' % group_id, str(memsize))
             kv.put('tarantool/%s/blueprint/check_period' % group_id,
                    str(check_period))
+            kv.put('tarantool/%s/blueprint/instances/1/addr' % group_id, ip1)
+            # The group becomes visible with this key, so it goes last
             kv.put('tarantool/%s/blueprint/creation_time' % group_id,
                    creation_time)
-            kv.put('tarantool/%s/blueprint/instances/1/addr' % group_id, ip1)
 
-            Sense.update()
+            Sense.refresh_group(group_id)
 
             tar = Tarantino(global_env.consul_host, group_id)
 
             create_task.log("Allocating instance to physical nodes")
 
             tar.allocate()
-            Sense.update()
+            tar.refresh()
 
             create_task.log("Registering services")
             tar.register()
-            Sense.update()
+            tar.refresh()
 
             create_task.log("Creating containers")
             tar.create_containers(password)
-            Sense.update()
+            tar.refresh()
 
             create_task.log("Completed creating group")
 
@@ -138,7 +139,7 @@ class Tarantino(group.Group):
 
             delete_task.log("Completed removing group")
 
-            Sense.update()
+            self.refresh()
             delete_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to delete group '%s'", group_id)
@@ -147,8 +148,7 @@ class Tarantino(group.Group):
             raise
 
     def allocate(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         blueprint = self.blueprint
@@ -165,12 +165,8 @@ class Tarantino(group.Group):
 
         instance_id = self.group_id + '_' + instance_num
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
-        consul_host = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                consul_host = host['consul_host']
+        host = self.state.resolve_docker_host(docker_host)
+        consul_host = host['consul_host'] if host else None
         if not consul_host:
             raise RuntimeError("Failed to find consul host of %s" %
                                docker_host)
@@ -178,8 +174,7 @@ class Tarantino(group.Group):
         addr = blueprint['instances'][instance_num]['addr']
         check_period = blueprint['check_period']
 
-        consul_obj = consul.Consul(host=consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client(consul_host)
 
         container_check = {
             'docker_container_id': instance_id,
@@ -229,19 +224,15 @@ class Tarantino(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-               host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
@@ -250,8 +241,7 @@ class Tarantino(group.Group):
         if instance_num == '2':
             replica_ip = blueprint['instances']['1']['addr']
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         self.ensure_image(docker_addr)
         self.ensure_network(docker_addr)
@@ -322,7 +312,7 @@ class Tarantino(group.Group):
             if docker_image_name:
                 self.upgrade(update_task)
 
-            Sense.update()
+            self.refresh()
             update_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to update group '%s'", self.group_id)
@@ -331,8 +321,7 @@ class Tarantino(group.Group):
             raise
 
     def resize(self, memsize, update_task):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         update_task.log("Resizing instance")
@@ -343,8 +332,7 @@ class Tarantino(group.Group):
 
 
     def rename(self, name, update_task):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         msg = "Renaming group '%s' to '%s'" % (self.group_id, name)
@@ -355,8 +343,7 @@ class Tarantino(group.Group):
 
 
     def ensure_image(self, docker_addr):
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
         image_exists = any(['tarantool/tarantino:latest' in
                             (i['RepoTags'] or [])
                             for i in docker_obj.images()])
@@ -366,18 +353,20 @@ class Tarantino(group.Group):
 
         response = docker_obj.pull('tarantool/tarantino', stream=True)
 
-        for line in response:
-            decoded_line = json.loads(line.decode('utf-8'))
-            if 'stream' in decoded_line:
-                logging.info("Pull tarantino on %s: %s",
-                             docker_addr,
-                             decoded_line['stream'])
+        try:
+            for line in response:
+                decoded_line = json.loads(line.decode('utf-8'))
+                if 'stream' in decoded_line:
+                    logging.info("Pull tarantino on %s: %s",
+                                 docker_addr,
+                                 decoded_line['stream'])
+        finally:
+            docker_pool.close_stream(response)
 
     def ensure_network(self, docker_addr):
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
-        settings = Sense.network_settings()
+        settings = self.state.network_settings()
         network_name = settings['network_name']
         subnet = settings['subnet']
 
@@ -414,18 +403,12 @@ class Tarantino(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -434,15 +417,14 @@ class Tarantino(group.Group):
                          memsize,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_set_config.lua TARANTOOL_SLAB_ALLOC_ARENA " + \
                   str(float(memsize)/1024)
 
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -461,18 +443,12 @@ class Tarantino(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                   host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -480,8 +456,7 @@ class Tarantino(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             buf = io.BytesIO(tar_string('service.json', config_str))
             status = docker_obj.put_archive(self.group_id + '_' + instance_num,
@@ -2,12 +2,13 @@
 # pylint: disable=missing-super-argument
 import global_env
 import group
-import consul
+import consul_pool
 from sense import Sense
 import ip_pool
 import random
 import logging
 import docker
+import docker_pool
 import uuid
 import time
 import tarantool
@@ -76,8 +77,7 @@ class Tarantool(group.Group):
         group_id = create_task.group_id
 
         try:
-            consul_obj = consul.Consul(host=global_env.consul_host,
-                                       token=global_env.consul_acl_token)
+            consul_obj = consul_pool.get_client()
             kv = consul_obj.kv
 
             create_task.log("Creating group '%s'", group_id)
@@ -90,28 +90,29 @@ class Tarantool(group.Group):
             kv.put('tarantool/%s/blueprint/name' % group_id, name.encode('utf-8'))
             kv.put('tarantool/%s/blueprint/memsize' % group_id, str(memsize))
             kv.put('tarantool/%s/blueprint/check_period' % group_id, str(check_period))
-            kv.put('tarantool/%s/blueprint/creation_time' % group_id, creation_time)
             kv.put('tarantool/%s/blueprint/instances/1/addr' % group_id, ip1)
             kv.put('tarantool/%s/blueprint/instances/2/addr' % group_id, ip2)
+            # The group becomes visible with this key, so it goes last
+            kv.put('tarantool/%s/blueprint/creation_time' % group_id, creation_time)
 
-            Sense.update()
+            Sense.refresh_group(group_id)
 
             tar = Tarantool(global_env.consul_host, group_id, application_dir)
 
             create_task.log("Allocating instance to physical nodes")
 
             tar.allocate()
-            Sense.update()
+            tar.refresh()
 
             create_task.log("Registering services")
             tar.node_name = name
 
             tar.register()
-            Sense.update()
+            tar.refresh()
 
             create_task.log("Creating containers")
             tar.create_containers(password)
-            Sense.update()
+            tar.refresh()
 
             create_task.log("Enabling replication")
             tar.wait_for_instances(create_task)
@@ -146,7 +147,7 @@ class Tarantool(group.Group):
 
             delete_task.log("Completed removing group")
 
-            Sense.update()
+            self.refresh()
             delete_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to delete group '%s'", group_id)
@@ -166,7 +167,7 @@ class Tarantool(group.Group):
 
             upgrade_task.log("Completed upgrading containers")
 
-            Sense.update()
+            self.refresh()
             upgrade_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to upgrade group '%s'", group_id)
@@ -206,7 +207,7 @@ class Tarantool(group.Group):
             if backup_id:
                 self.restore(backup_id, storage, update_task)
 
-            Sense.update()
+            self.refresh()
             update_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
             logging.exception("Failed to update group '%s'", self.group_id)
@@ -249,7 +250,7 @@ class Tarantool(group.Group):
         self.create_container(instance_num, other_instance_num,
                               password=password)
 
-        Sense.update()
+        self.refresh()
 
         if code_link:
             update_task.log('Recovering code: %s', code_link)
@@ -259,8 +260,7 @@ class Tarantool(group.Group):
         self.register_instance(instance_num)
 
     def rename(self, name, update_task):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         msg = "Renaming group '%s' to '%s'" % (self.group_id, name)
@@ -270,8 +270,7 @@ class Tarantool(group.Group):
         kv.put('tarantool/%s/blueprint/name' % self.group_id, name)
 
     def resize(self, memsize, update_task):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         update_task.log("Resizing instance 1")
@@ -295,8 +294,7 @@ class Tarantool(group.Group):
         self.set_instance_password("2", password)
 
     def allocate(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         blueprint = self.blueprint
@@ -310,8 +308,7 @@ class Tarantool(group.Group):
                self.group_id, host2)
 
     def unallocate(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         logging.info("Unallocating '%s'", self.group_id)
@@ -340,24 +337,19 @@ class Tarantool(group.Group):
             allocation = self.allocation
             instance_id = self.group_id + '_' + instance_num
             docker_host = allocation['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
 
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = 'ls /var/lib/tarantool'
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -392,7 +384,7 @@ class Tarantool(group.Group):
             cmd = 'ls /opt/deploy'
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -413,7 +405,7 @@ class Tarantool(group.Group):
                 cmd = "mkdir -p '%s'" % (dirname % tmp_backup_dir)
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -426,7 +418,7 @@ class Tarantool(group.Group):
                     file_to_backup, tmp_backup_dir, file_to_backup)
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -438,7 +430,7 @@ class Tarantool(group.Group):
                     code_directory, tmp_backup_dir, code_directory)
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -448,7 +440,7 @@ class Tarantool(group.Group):
             cmd = "cp -dp /opt/tarantool %s/current" % tmp_backup_dir
             exec_id = docker_obj.exec_create(
                 self.group_id + '_' + instance_num, cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -456,12 +448,15 @@ class Tarantool(group.Group):
                     "Failed copy code symlink: " + out.decode('utf-8'))
 
             strm, _ = docker_obj.get_archive(instance_id, tmp_backup_dir + '/.')
-            archive_id, size = storage.put_archive(strm)
+            try:
+                archive_id, size = storage.put_archive(strm)
+            finally:
+                docker_pool.close_stream(strm)
 
             cmd = "rm -rf /var/lib/tarantool/backup-*"
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            out = docker_obj.exec_start(exec_id)
+            out = docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -473,7 +468,7 @@ class Tarantool(group.Group):
             storage.register_backup(backup_id, archive_id, group_id,
                                     'memcached', size, mem_used)
 
-            Sense.update()
+            Sense.refresh_backup(backup_id)
 
             backup_task.set_status(task.STATUS_SUCCESS)
         except Exception as ex:
@@ -487,7 +482,7 @@ class Tarantool(group.Group):
 
         restore_task.log("Restoring group '%s'", group_id)
 
-        backup = Sense.backups()[backup_id]
+        backup = self.state.backups()[backup_id]
         archive_id = backup['archive_id']
         mem_used = backup['mem_used']
 
@@ -496,21 +491,16 @@ class Tarantool(group.Group):
                 allocation = self.allocation
                 instance_id = self.group_id + '_' + instance_num
                 docker_host = allocation['instances'][instance_num]['host']
-                docker_hosts = Sense.docker_hosts()
 
                 restore_task.log("Restoring instance: '%s'", instance_id)
 
-                docker_addr = None
-                for host in docker_hosts:
-                    if host['addr'].split(':')[0] == docker_host or \
-                                    host['consul_host'] == docker_host:
-                        docker_addr = host['addr']
+                host = self.state.resolve_docker_host(docker_host)
+                docker_addr = host['addr'] if host else None
 
                 if not docker_addr:
                     raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
-                docker_obj = docker.Client(base_url=docker_addr,
-                                           tls=global_env.docker_tls_config)
+                docker_obj = docker_pool.get_client(docker_addr)
 
                 if mem_used > blueprint['memsize']:
                     err = ("Backed up instance used {} MiB of RAM, but " +
@@ -524,7 +514,7 @@ class Tarantool(group.Group):
                 cmd = "mkdir '%s'" % tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -539,7 +529,7 @@ class Tarantool(group.Group):
                 cmd = "sh -c 'rm -rf /var/lib/tarantool/*.snap'"
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -550,7 +540,7 @@ class Tarantool(group.Group):
                 cmd = "sh -c 'rm -rf /var/lib/tarantool/*.xlog'"
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -561,7 +551,7 @@ class Tarantool(group.Group):
                 cmd = "ln -snf / /opt/tarantool"
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -572,7 +562,7 @@ class Tarantool(group.Group):
                 cmd = "sh -c 'rm -rf /opt/deploy/*'"
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -584,7 +574,7 @@ class Tarantool(group.Group):
                       tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -596,7 +586,7 @@ class Tarantool(group.Group):
                       tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -604,14 +594,16 @@ class Tarantool(group.Group):
                         "Failed to restore code of " +
                         instance_id + ": " + out.decode('utf-8'))
 
-                _, stat = docker_obj.get_archive(instance_id,
-                                                 '%s/current' % tmp_restore_dir)
+                strm, stat = docker_obj.get_archive(
+                    instance_id, '%s/current' % tmp_restore_dir)
+                # only the stat header is needed
+                docker_pool.close_stream(strm)
                 code_link = stat['linkTarget']
 
                 cmd = "ln -snf '%s' /opt/tarantool" % code_link
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -622,7 +614,7 @@ class Tarantool(group.Group):
                 cmd = "rm -rf '%s'" % tmp_restore_dir
                 exec_id = docker_obj.exec_create(
                     self.group_id + '_' + instance_num, cmd)
-                out = docker_obj.exec_start(exec_id)
+                out = docker_pool.exec_output(docker_obj, exec_id)
                 ret = docker_obj.exec_inspect(exec_id)
 
                 if ret['ExitCode'] != 0:
@@ -649,8 +641,7 @@ class Tarantool(group.Group):
         self.remove_container("2")
 
     def remove_blueprint(self):
-        consul_obj = consul.Consul(host=global_env.consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client()
         kv = consul_obj.kv
 
         logging.info("Removing blueprint '%s'", self.group_id)
@@ -672,30 +663,28 @@ class Tarantool(group.Group):
             other_addrs = [blueprint['instances'][i]['addr']
                            for i in other_instances]
             docker_host = allocation['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
             instance_id = self.group_id + '_' + instance_num
 
             wait_task.log("Waiting for '%s' to go up. It may take time to " +
                           "load data from disk.", instance_id)
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_is_up"
             attempts = 0
             while True:
                 exec_id = docker_obj.exec_create(instance_id,
                                                  cmd)
-                stream = docker_obj.exec_start(exec_id, stream=True)
+                stream = docker_pool.exec_stream(docker_obj, exec_id)
 
-                for line in stream:
-                    logging.info("Exec: %s", str(line))
+                try:
+                    for line in stream:
+                        logging.info("Exec: %s", str(line))
+                finally:
+                    docker_pool.close_stream(stream)
 
                 ret = docker_obj.exec_inspect(exec_id)
 
@@ -722,19 +711,14 @@ class Tarantool(group.Group):
             other_addrs = [blueprint['instances'][i]['addr']
                            for i in other_instances]
             docker_host = allocation['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
             logging.info("Enabling replication between '%s' and '%s'",
                          addr, str(other_addrs))
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_set_config.lua TARANTOOL_REPLICATION_SOURCE " + \
                   ",".join(other_addrs)
@@ -743,10 +727,13 @@ class Tarantool(group.Group):
             while attempts < 5:
                 exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                                  cmd)
-                stream = docker_obj.exec_start(exec_id, stream=True)
+                stream = docker_pool.exec_stream(docker_obj, exec_id)
 
-                for line in stream:
-                    logging.info("Exec: %s", str(line))
+                try:
+                    for line in stream:
+                        logging.info("Exec: %s", str(line))
+                finally:
+                    docker_pool.close_stream(stream)
 
                 ret = docker_obj.exec_inspect(exec_id)
 
@@ -766,20 +753,15 @@ class Tarantool(group.Group):
 
         instance_id = self.group_id + '_' + instance_num
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
-        consul_host = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-                            host['consul_host'] == docker_host:
-                consul_host = host['consul_host']
+        host = self.state.resolve_docker_host(docker_host)
+        consul_host = host['consul_host'] if host else None
         if not consul_host:
             raise RuntimeError("Failed to find consul host of %s" % docker_host)
 
         addr = blueprint['instances'][instance_num]['addr']
         check_period = blueprint['check_period']
 
-        consul_obj = consul.Consul(host=consul_host,
-                                   token=global_env.consul_acl_token)
+        consul_obj = consul_pool.get_client(consul_host)
 
         replication_check = {
             'docker_container_id': instance_id,
@@ -825,25 +807,20 @@ class Tarantool(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-                            host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         try:
             docker_obj.disconnect_container_from_network(instance_id,
@@ -862,22 +839,17 @@ class Tarantool(group.Group):
         instance_id = self.group_id + '_' + instance_num
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
-        consul_host = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-                            host['consul_host'] == docker_host:
-                consul_host = host['consul_host']
+        host = self.state.resolve_docker_host(docker_host)
+        consul_host = host['consul_host'] if host else None
         if not consul_host:
             raise RuntimeError("Failed to find consul host of %s" % docker_host)
 
-        consul_hosts = [h['addr'].split(':')[0] for h in Sense.consul_hosts()
+        consul_hosts = [h['addr'].split(':')[0] for h in self.state.consul_hosts()
                         if h['status'] == 'passing']
 
         if services:
             if consul_host in consul_hosts:
-                consul_obj = consul.Consul(host=consul_host,
-                                           token=global_env.consul_acl_token)
+                consul_obj = consul_pool.get_client(consul_host)
 
                 check_id = instance_id + '_memory'
                 logging.info("Unregistering check '%s'", check_id)
@@ -902,19 +874,15 @@ class Tarantool(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-                            host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
@@ -923,8 +891,7 @@ class Tarantool(group.Group):
         if other_instance_num is not None:
             replica_ip = blueprint['instances'][other_instance_num]['addr']
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         self.ensure_image(docker_addr)
         self.ensure_network(docker_addr)
@@ -1004,19 +971,15 @@ class Tarantool(group.Group):
         instance_id = self.group_id + '_' + instance_num
         addr = blueprint['instances'][instance_num]['addr']
         memsize = blueprint['memsize']
-        network_settings = Sense.network_settings()
+        network_settings = self.state.network_settings()
         network_name = network_settings['network_name']
         if not network_name:
             raise RuntimeError("Network name is not specified in settings")
 
         docker_host = allocation['instances'][instance_num]['host']
-        docker_hosts = Sense.docker_hosts()
 
-        docker_addr = None
-        for host in docker_hosts:
-            if host['addr'].split(':')[0] == docker_host or \
-                            host['consul_host'] == docker_host:
-                docker_addr = host['addr']
+        host = self.state.resolve_docker_host(docker_host)
+        docker_addr = host['addr'] if host else None
 
         if not docker_addr:
             raise RuntimeError("No such Docker host: '%s'" % docker_host)
@@ -1025,8 +988,7 @@ class Tarantool(group.Group):
         if instance_num == '2':
             replica_ip = blueprint['instances']['1']['addr']
 
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
         self.ensure_image(docker_addr)
         self.ensure_network(docker_addr)
@@ -1102,18 +1064,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1121,8 +1077,7 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
             docker_obj.stop(container=instance_id)
             docker_obj.remove_container(container=instance_id)
         else:
@@ -1136,18 +1091,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1156,15 +1105,14 @@ class Tarantool(group.Group):
                          memsize,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_set_config.lua TARANTOOL_SLAB_ALLOC_ARENA " + \
                   str(float(memsize) / 1024)
 
             exec_id = docker_obj.exec_create(self.group_id + '_' + instance_num,
                                              cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1197,18 +1145,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1216,8 +1158,7 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             time_str = datetime.datetime.utcnow().isoformat()
             destdir = "/opt/deploy/%s" % time_str
@@ -1225,7 +1166,7 @@ class Tarantool(group.Group):
             cmd = "mkdir -p '%s'" % destdir
             exec_id = docker_obj.exec_create(self.group_id + '_' +
                                              instance_num, cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1242,7 +1183,7 @@ class Tarantool(group.Group):
             cmd = "ln -snf '%s' /opt/tarantool" % destdir
             exec_id = docker_obj.exec_create(self.group_id + '_' +
                                              instance_num, cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1263,18 +1204,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1282,15 +1217,14 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             cmd = "tarantool_set_config.lua " + \
                   "TARANTOOL_USER_PASSWORD " + password
 
             exec_id = docker_obj.exec_create(self.group_id + '_' +
                                              instance_num, cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1308,18 +1242,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1327,14 +1255,16 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             try:
                 strm, stat = docker_obj.get_archive(instance_id,
                                                     '/etc/tarantool/config.yml')
                 bio = io.BytesIO()
-                shutil.copyfileobj(strm, bio)
+                try:
+                    shutil.copyfileobj(strm, bio)
+                finally:
+                    docker_pool.close_stream(strm)
                 bio.seek(0)
                 tar = tarfile.open(fileobj=bio)
 
@@ -1356,18 +1286,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1375,14 +1299,16 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             try:
                 strm, stat = docker_obj.get_archive(instance_id,
                                                     code_link)
                 bio = io.BytesIO()
-                shutil.copyfileobj(strm, bio)
+                try:
+                    shutil.copyfileobj(strm, bio)
+                finally:
+                    docker_pool.close_stream(strm)
                 bio.seek(0)
                 return bio
             except docker.errors.NotFound:
@@ -1397,18 +1323,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1416,12 +1336,13 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             try:
                 strm, stat = docker_obj.get_archive(instance_id,
                                                     '/opt/tarantool')
+                # only the stat header is needed
+                docker_pool.close_stream(strm)
                 target = stat['linkTarget']
                 return target
             except docker.errors.NotFound:
@@ -1438,18 +1359,12 @@ class Tarantool(group.Group):
             return
 
         instance_id = self.group_id + '_' + instance_num
-        docker_hosts = [h['addr'].split(':')[0] for h in Sense.docker_hosts()
-                        if h['status'] == 'passing']
 
         if containers:
             docker_host = containers['instances'][instance_num]['host']
-            docker_hosts = Sense.docker_hosts()
 
-            docker_addr = None
-            for host in docker_hosts:
-                if host['addr'].split(':')[0] == docker_host or \
-                                host['consul_host'] == docker_host:
-                    docker_addr = host['addr']
+            host = self.state.resolve_docker_host(docker_host)
+            docker_addr = host['addr'] if host else None
             if not docker_addr:
                 raise RuntimeError("No such Docker host: '%s'" % docker_host)
 
@@ -1457,8 +1372,7 @@ class Tarantool(group.Group):
                          instance_id,
                          docker_host)
 
-            docker_obj = docker.Client(base_url=docker_addr,
-                                       tls=global_env.docker_tls_config)
+            docker_obj = docker_pool.get_client(docker_addr)
 
             status = docker_obj.put_archive(self.group_id + '_' + instance_num,
                                             '/opt/deploy',
@@ -1470,7 +1384,7 @@ class Tarantool(group.Group):
             cmd = "ln -snf '%s' /opt/tarantool" % code_link
             exec_id = docker_obj.exec_create(self.group_id + '_' +
                                              instance_num, cmd)
-            docker_obj.exec_start(exec_id)
+            docker_pool.exec_output(docker_obj, exec_id)
             ret = docker_obj.exec_inspect(exec_id)
 
             if ret['ExitCode'] != 0:
@@ -1480,8 +1394,7 @@ class Tarantool(group.Group):
 
     @classmethod
     def ensure_image(cls, docker_addr, force=False):
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
         image_exists = any(['tarantool-cloud-tarantool:latest' in (i['RepoTags'] or [])
                             for i in docker_obj.images()])
 
@@ -1510,10 +1423,9 @@ class Tarantool(group.Group):
                                  decoded_line['stream'])
 
     def ensure_network(self, docker_addr):
-        docker_obj = docker.Client(base_url=docker_addr,
-                                   tls=global_env.docker_tls_config)
+        docker_obj = docker_pool.get_client(docker_addr)
 
-        settings = Sense.network_settings()
+        settings = self.state.network_settings()
         network_name = settings['network_name']
         subnet = settings['subnet']
 
@@ -1,9 +1,14 @@
 #!/usr/bin/env python
 
 import uuid
+import time
+import bisect
 import datetime
+import collections
 import gevent
 import logging
+import events
+import global_env
 
 STATUS_RUNNING = "running"
 STATUS_SUCCESS = "success"
@@ -13,16 +18,129 @@ STATUS_CRITICAL = "error"
 
 STATUSES = [STATUS_SUCCESS, STATUS_WARNING, STATUS_CRITICAL, STATUS_RUNNING]
 
+# rough size of a log entry apart from its message, for memory accounting
+LOG_ENTRY_OVERHEAD = 400 # bytes
+
+
+def entry_size(entry):
+    return len(entry['message']) + LOG_ENTRY_OVERHEAD
+
+
+class TaskLog(object):
+    """
+    Ring buffer of the last 'size' log entries of a task. Entries have
+    increasing 'index' fields, but not necessarily consecutive ones, so
+    they are found by binary search rather than by a scan. With a size
+    of 0, every entry is counted as dropped right away.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = []
+        # position in self.entries of the oldest entry
+        self.start = 0
+        # number of entries pushed out of the buffer
+        self.dropped = 0
+        # index of the newest entry pushed out of the buffer
+        self.dropped_index = 0
+        # approximate size of the entries in the buffer
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        for pos in range(len(self.entries)):
+            yield self.get(pos)
+
+    def get(self, pos):
+        """
+        Returns the entry at 'pos', counting from the oldest one.
+        """
+        return self.entries[(self.start + pos) % len(self.entries)]
+
+    def last(self):
+        if not self.entries:
+            return None
+        return self.get(len(self.entries) - 1)
+
+    def append(self, entry):
+        if self.size == 0:
+            self.dropped += 1
+            self.dropped_index = entry['index']
+            return
+
+        self.bytes += entry_size(entry)
+
+        if len(self.entries) < self.size:
+            self.entries.append(entry)
+            return
+
+        self.dropped += 1
+        self.dropped_index = self.entries[self.start]['index']
+        self.bytes -= entry_size(self.entries[self.start])
+        self.entries[self.start] = entry
+        self.start = (self.start + 1) % self.size
+
+    def since(self, index):
+        """
+        Returns the entries with indexes greater than 'index'. If some
+        of them were already dropped, a marker entry that says so comes
+        first.
+        """
+        lo, hi = 0, len(self.entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get(mid)['index'] <= index:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        result = [self.get(pos) for pos in range(lo, len(self.entries))]
+
+        if index < self.dropped_index:
+            result.insert(0, {
+                "timestamp": result[0]["timestamp"] if result else None,
+                "progress": result[0]["progress"] if result else None,
+                "message": "%d earlier log entries were dropped" %
+                self.dropped,
+                "index": self.dropped_index,
+                "dropped": self.dropped})
+
+        return result
+
+    def shrink(self, size):
+        """
+        Keeps only the last 'size' entries, and only as many from now
+        on. Returns the number of entries dropped.
+        """
+        entries = list(self)
+        dropped = max(len(entries) - size, 0)
+
+        if dropped:
+            self.dropped += dropped
+            self.dropped_index = entries[dropped - 1]['index']
+            self.bytes -= sum(entry_size(e) for e in entries[:dropped])
+
+        self.size = size
+        self.entries = entries[dropped:]
+        self.start = 0
+        return dropped
+
+
 class Task(object):
     def __init__(self, task_type):
         self.task_id = uuid.uuid4().hex
         self.task_type = task_type
         self.index = 0
-        self.logs = []
+        self.logs = TaskLog(global_env.task_log_size)
         self.progress = 0
         self.status = STATUS_RUNNING
         self.message = ""
         self.event = gevent.event.Event()
+        self.creation_time = time.time()
+        self.completion_time = None
+        # the TaskStore the task is registered in
+        self.store = None
 
     def log(self, msg, *args, **kwargs):
         progress = kwargs.get('progress', None)
@@ -38,26 +156,26 @@ class Task(object):
             self.progress = progress
 
         self.index += 1
-        self.logs.append({
+        entry = {
             "timestamp": timestamp,
             "progress": self.progress,
             "message": message,
             "index": self.index
-        })
+        }
+        self.logs.append(entry)
         self.notify()
 
+        if self.store is not None:
+            self.store.logged(self, entry)
+
     def get_index(self):
         return self.index
 
     def get_dict(self, index = None):
-        logs = None
-        if index:
-            logs = []
-            for log in self.logs:
-                if log['index'] > index:
-                    logs.append(log)
-        else:
-            logs = self.logs
+        logs = self.logs.since(index or 0)
+
+        creation_time = datetime.datetime.fromtimestamp(
+            self.creation_time, datetime.timezone.utc)
 
         obj = {"id": self.task_id,
                "type": self.task_type,
@@ -65,10 +183,20 @@ class Task(object):
                "message": self.message,
                "index": self.index,
                "progress": self.progress,
+               "creation_time": creation_time.isoformat(),
                "logs": logs}
 
         return obj
 
+    def summary(self):
+        """
+        Same as get_dict(), without the logs. Asking for the logs after
+        the last index makes them empty, so none are built.
+        """
+        obj = self.get_dict(self.index)
+        del obj['logs']
+        return obj
+
     def wait(self, index, timeout=None):
         if self.index != index:
             return self.index
@@ -86,15 +214,214 @@ class Task(object):
     def notify(self):
         self.event.set()
         self.event.clear()
+        events.task_changed(self)
 
     def set_status(self, status, message=None):
         if status not in STATUSES:
             raise RuntimeError("Unknown status: '%s'" % status)
 
+        old_status = self.status
         self.status = status
 
+        if status != STATUS_RUNNING and self.completion_time is None:
+            self.completion_time = time.time()
+
         if message is not None:
             self.message = message
 
         self.index += 1
         self.notify()
+
+        if self.store is not None:
+            self.store.status_changed(self, old_status)
+
+    def compact(self, size):
+        """
+        Drops all but the last 'size' log entries. Entries keep their
+        indexes, so clients that follow the log by index are not
+        confused.
+        """
+        return self.logs.shrink(size)
+
+    def memory_usage(self):
+        """
+        Approximate size of the task logs, in bytes.
+        """
+        return self.logs.bytes
+
+
+class TaskStore(object):
+    """
+    Registry of tasks, indexed by group id, type and status. Running
+    tasks are kept until they complete. Completed ones have their logs
+    compacted and are kept according to the retention settings in
+    global_env, oldest completed first to go.
+    """
+    def __init__(self):
+        # task id -> Task, in the order of creation
+        self.tasks = collections.OrderedDict()
+        # sorted task ids, for paging
+        self.ids = []
+        # task id -> Task, in the order of completion
+        self.completed = collections.OrderedDict()
+        # field -> value -> set of task ids
+        self.exact = {'group_id': collections.defaultdict(set),
+                      'type': collections.defaultdict(set),
+                      'status': collections.defaultdict(set)}
+        # tasks can also be looked up by creation time, which is the
+        # order of self.tasks
+        self.ordered = {'creation_time': None}
+        self.evicted = 0
+        self.compacted_logs = 0
+        # journal.Journal that records the changes, if any
+        self.journal = None
+
+    def add(self, task):
+        task.store = self
+        self.tasks[task.task_id] = task
+        bisect.insort(self.ids, task.task_id)
+        self.index(task)
+
+        if self.journal is not None:
+            self.journal.task_added(task)
+
+        if task.status != STATUS_RUNNING:
+            self.complete(task)
+
+        self.expire()
+
+    def get(self, task_id):
+        return self.tasks.get(task_id, None)
+
+    def keys(self, task):
+        return {'group_id': getattr(task, 'group_id', None),
+                'type': task.task_type,
+                'status': task.status}
+
+    def index(self, task):
+        for field, value in self.keys(task).items():
+            self.exact[field][value].add(task.task_id)
+
+    def unindex(self, task, keys):
+        for field, value in keys.items():
+            ids = self.exact[field][value]
+            ids.discard(task.task_id)
+            if not ids:
+                del self.exact[field][value]
+
+    def logged(self, task, entry):
+        if self.journal is not None and task.task_id in self.tasks:
+            self.journal.task_logged(task, entry)
+
+    def status_changed(self, task, old_status):
+        if task.task_id not in self.tasks:
+            return
+
+        if self.journal is not None:
+            self.journal.task_status_changed(task)
+
+        keys = self.keys(task)
+        keys['status'] = old_status
+        self.unindex(task, keys)
+        self.index(task)
+
+        if task.status != STATUS_RUNNING:
+            self.complete(task)
+
+        self.expire()
+
+    def complete(self, task):
+        if task.task_id in self.completed:
+            return
+        self.completed[task.task_id] = task
+        self.compacted_logs += task.compact(
+            global_env.task_completed_log_size)
+
+    def remove(self, task):
+        del self.tasks[task.task_id]
+        del self.ids[bisect.bisect_left(self.ids, task.task_id)]
+        self.completed.pop(task.task_id, None)
+        self.unindex(task, self.keys(task))
+        task.store = None
+        self.evicted += 1
+
+        if self.journal is not None:
+            self.journal.task_removed(task)
+
+    def expire(self):
+        """
+        Evicts completed tasks that are over the retention limits.
+        """
+        deadline = time.time() - global_env.task_retention_age
+
+        while self.completed:
+            task = next(iter(self.completed.values()))
+            if len(self.completed) <= global_env.task_retention_count and \
+               task.completion_time > deadline:
+                break
+            self.remove(task)
+
+    def entry(self, task_id):
+        return self.tasks[task_id].summary()
+
+    def query(self, exact=None, prefix=None, after=None,
+              cursor=None, limit=None):
+        """
+        Same as listing.Catalog.query(), with the tasks as entries.
+        """
+        self.expire()
+
+        candidates = None
+        for field, value in (exact or {}).items():
+            ids = self.exact[field].get(value, set())
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+
+        created_after = (after or {}).get('creation_time', None)
+        if created_after is not None:
+            created_after = created_after.timestamp()
+            recent = []
+            for task in reversed(self.tasks.values()):
+                if task.creation_time <= created_after:
+                    break
+                recent.append(task.task_id)
+            if candidates is None or len(recent) < len(candidates):
+                candidates = recent
+
+        if candidates is None:
+            ids = self.ids
+        else:
+            ids = sorted(candidates)
+
+        start = 0
+        if cursor is not None:
+            start = bisect.bisect_right(ids, cursor)
+
+        result = []
+        for pos in range(start, len(ids)):
+            task = self.tasks[ids[pos]]
+            keys = self.keys(task)
+            if any(keys[field] != value
+                   for field, value in (exact or {}).items()):
+                continue
+            if created_after is not None and \
+               task.creation_time <= created_after:
+                continue
+
+            if limit is not None and len(result) == limit:
+                return result, result[-1]
+
+            result.append(task.task_id)
+
+        return result, None
+
+    def stats(self):
+        running = len(self.tasks) - len(self.completed)
+        return {'tasks': len(self.tasks),
+                'running': running,
+                'completed': len(self.completed),
+                'evicted': self.evicted,
+                'compacted_logs': self.compacted_logs,
+                'log_entries': sum(len(t.logs) for t in self.tasks.values()),
+                'memory_usage': sum(t.memory_usage()
+                                    for t in self.tasks.values())}
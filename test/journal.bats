@@ -0,0 +1,88 @@
+#!/usr/bin/env bats
+
+# Replays task journals the way the server does at startup. Needs
+# neither Consul nor Docker.
+
+SRC_DIR=$BATS_TEST_DIRNAME/..
+
+setup()
+{
+    JOURNAL_DIR=$(mktemp -d)
+}
+
+teardown()
+{
+    rm -rf "$JOURNAL_DIR"
+}
+
+create_record()
+{
+    task_id=$1
+    echo "{\"op\": \"create\", \"id\": \"$task_id\", \"type\": \"Create group\", \"time\": 1500000000.0, \"extra\": {\"group_id\": \"g_$task_id\"}}"
+}
+
+log_record()
+{
+    task_id=$1
+    index=$2
+    echo "{\"op\": \"log\", \"id\": \"$task_id\", \"entry\": {\"timestamp\": \"2017-07-14T02:40:00+00:00\", \"progress\": $index, \"message\": \"step $index\", \"index\": $index}}"
+}
+
+status_record()
+{
+    task_id=$1
+    status=$2
+    index=$3
+    echo "{\"op\": \"status\", \"id\": \"$task_id\", \"status\": \"$status\", \"message\": \"done\", \"index\": $index, \"time\": 1500000100.0}"
+}
+
+remove_record()
+{
+    task_id=$1
+    echo "{\"op\": \"remove\", \"id\": \"$task_id\"}"
+}
+
+# Prints "<id> <status> <number of log entries> <index>" for every
+# restored task
+replay_journal()
+{
+    journal_dir=$1
+    (cd "$SRC_DIR" && python3 <<-EOF
+import journal
+import task
+for task_obj in journal.Journal("$journal_dir", task.TaskStore()).replay():
+    print(task_obj.task_id, task_obj.status, len(task_obj.logs),
+          task_obj.index)
+EOF
+    )
+}
+
+@test "replaying a journal with a truncated last line" {
+    segment=$JOURNAL_DIR/tasks-00000001.log
+
+    create_record a >> $segment
+    log_record a 1 >> $segment
+    log_record a 2 >> $segment
+    status_record a success 3 >> $segment
+    # a write cut short by a crash
+    log_record a 4 | head -c 40 >> $segment
+
+    run replay_journal $JOURNAL_DIR
+
+    [ "$status" -eq 0 ]
+    [[ "$output" == *"Skipping damaged record"* ]]
+    [ "${lines[${#lines[@]}-1]}" = "a success 2 3" ]
+}
+
+@test "replaying a journal with a removed task" {
+    create_record a >> $JOURNAL_DIR/tasks-00000001.log
+    log_record a 1 >> $JOURNAL_DIR/tasks-00000001.log
+    create_record b >> $JOURNAL_DIR/tasks-00000001.log
+    log_record b 1 >> $JOURNAL_DIR/tasks-00000002.log
+    remove_record a >> $JOURNAL_DIR/tasks-00000002.log
+
+    run replay_journal $JOURNAL_DIR
+
+    [ "$status" -eq 0 ]
+    [ "$output" = "b running 1 1" ]
+}
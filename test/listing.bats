@@ -0,0 +1,111 @@
+#!/usr/bin/env bats
+
+# Filtering and paging of listing.Catalog. Needs neither Consul nor
+# Docker.
+
+SRC_DIR=$BATS_TEST_DIRNAME/..
+
+# groups 'g00'..'g19' named 'n0'..'n19', of type 'even' or 'odd', and
+# created on consecutive days
+CATALOG='
+import datetime
+import listing
+
+entries = {"g%02d" % i: {"name": "n%d" % i,
+                         "type": "even" if i % 2 == 0 else "odd",
+                         "day": i}
+           for i in range(20)}
+calls = {"type": 0}
+
+def entry_type(entry_id):
+    calls["type"] += 1
+    return [entries[entry_id]["type"]]
+
+def creation_time(entry_id):
+    return (datetime.datetime(2017, 1, 1, tzinfo=datetime.timezone.utc) +
+            datetime.timedelta(days=entries[entry_id]["day"]))
+
+catalog = listing.Catalog(
+    entries,
+    exact={"type": entry_type},
+    ordered={"name": lambda i: entries[i]["name"],
+             "creation_time": creation_time})
+calls["type"] = 0
+'
+
+# Runs python code from stdin next to the sources, after $CATALOG
+run_python()
+{
+    (cd "$SRC_DIR" && { echo "$CATALOG"; cat; } | python3 -)
+}
+
+@test "paging with a cursor" {
+    run run_python <<-'EOF'
+pages = []
+cursor = None
+while True:
+    ids, cursor = catalog.query(cursor=cursor, limit=8)
+    pages.append(ids)
+    if cursor is None:
+        break
+assert [len(page) for page in pages] == [8, 8, 4], pages
+assert sum(pages, []) == sorted(entries), pages
+assert pages[1][0] == 'g08', pages
+
+# the cursor stays valid when the entry it names is gone
+del entries['g07']
+catalog = listing.Catalog(entries, ordered={'name': lambda i: entries[i]['name']})
+assert catalog.query(cursor='g07', limit=1) == (['g08'], 'g08')
+EOF
+
+    [ "$status" -eq 0 ]
+}
+
+@test "prefix filter stops at the end of the prefix" {
+    run run_python <<-'EOF'
+ids, cursor = catalog.query(prefix={'name': 'n1'})
+assert cursor is None
+assert ids == ['g01'] + ['g%02d' % i for i in range(10, 20)], ids
+
+# 'n2' must not reach 'n3'
+assert catalog.query(prefix={'name': 'n2'}) == (['g02'], None)
+assert catalog.query(prefix={'name': 'x'}) == ([], None)
+assert len(catalog.query(prefix={'name': ''})[0]) == 20
+EOF
+
+    [ "$status" -eq 0 ]
+}
+
+@test "only the smallest index range is walked" {
+    run run_python <<-'EOF'
+ids, _ = catalog.query(exact={'type': 'odd'}, prefix={'name': 'n15'})
+assert ids == ['g15'], ids
+# only the one name that starts with 'n15' was checked, not the 10
+# odd groups
+assert calls['type'] == 1, calls
+
+calls['type'] = 0
+after = creation_time('g17')
+ids, _ = catalog.query(exact={'type': 'even'}, after={'creation_time': after})
+assert ids == ['g18'], ids
+assert calls['type'] == 2, calls
+EOF
+
+    [ "$status" -eq 0 ]
+}
+
+@test "filters, cursor and limit together" {
+    run run_python <<-'EOF'
+ids, cursor = catalog.query(exact={'type': 'even'}, cursor='g04', limit=3)
+assert ids == ['g06', 'g08', 'g10'], ids
+assert cursor == 'g10', cursor
+
+ids, cursor = catalog.query(exact={'type': 'even'}, cursor=cursor, limit=10)
+assert ids == ['g12', 'g14', 'g16', 'g18'], ids
+assert cursor is None
+
+assert catalog.query(exact={'type': 'none'}) == ([], None)
+EOF
+
+    [ "$status" -eq 0 ]
+}
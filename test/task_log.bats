@@ -0,0 +1,113 @@
+#!/usr/bin/env bats
+
+# The ring buffer that keeps task logs. Needs neither Consul nor Docker.
+
+SRC_DIR=$BATS_TEST_DIRNAME/..
+
+TASK_LOG='
+import task
+
+def entry(index):
+    return {"timestamp": None, "progress": 0,
+            "message": "step %d" % index, "index": index}
+
+def indexes(entries):
+    return [e["index"] for e in entries]
+
+def check_bytes(log):
+    assert log.bytes == sum(task.entry_size(e) for e in log), log.bytes
+'
+
+# Runs python code from stdin next to the sources, after $TASK_LOG
+run_python()
+{
+    (cd "$SRC_DIR" && { echo "$TASK_LOG"; cat; } | python3 -)
+}
+
+@test "wrapping around the ring" {
+    run run_python <<-'EOF'
+log = task.TaskLog(3)
+for index in range(1, 8):
+    log.append(entry(index))
+
+assert len(log) == 3
+assert indexes(log) == [5, 6, 7], indexes(log)
+assert log.get(0)['index'] == 5
+assert log.last()['index'] == 7
+assert log.dropped == 4
+assert log.dropped_index == 4
+check_bytes(log)
+EOF
+
+    [ "$status" -eq 0 ]
+}
+
+@test "reading entries since an index" {
+    run run_python <<-'EOF'
+log = task.TaskLog(4)
+# indexes are increasing but not consecutive
+for index in (2, 4, 6, 8, 10, 12):
+    log.append(entry(index))
+
+assert indexes(log.since(8)) == [10, 12]
+assert indexes(log.since(9)) == [10, 12]
+assert log.since(12) == []
+assert log.since(100) == []
+
+# entries up to 4 were dropped, so reading from before them starts
+# with a marker that says how many
+result = log.since(0)
+assert result[0]['dropped'] == 2, result[0]
+assert result[0]['index'] == 4
+assert indexes(result[1:]) == [6, 8, 10, 12]
+assert 'dropped' not in log.since(4)[0]
+EOF
+
+    [ "$status" -eq 0 ]
+}
+
+@test "shrinking a wrapped ring" {
+    run run_python <<-'EOF'
+log = task.TaskLog(3)
+for index in range(1, 6):
+    log.append(entry(index))
+
+assert log.shrink(2) == 1
+assert indexes(log) == [4, 5], indexes(log)
+assert log.dropped == 3
+assert log.dropped_index == 3
+check_bytes(log)
+
+log.append(entry(6))
+assert indexes(log) == [5, 6], indexes(log)
+check_bytes(log)
+
+assert log.shrink(5) == 0
+assert indexes(log) == [5, 6]
+EOF
+
+    [ "$status" -eq 0 ]
+}
+
+@test "a log of size 0 keeps nothing" {
+    run run_python <<-'EOF'
+log = task.TaskLog(0)
+log.append(entry(1))
+log.append(entry(2))
+
+assert len(log) == 0
+assert log.last() is None
+assert log.bytes == 0
+result = log.since(0)
+assert len(result) == 1 and result[0]['dropped'] == 2, result
+assert log.since(2) == []
+
+log = task.TaskLog(3)
+log.append(entry(1))
+assert log.shrink(0) == 1
+log.append(entry(2))
+assert len(log) == 0 and log.dropped == 2
+EOF
+
+    [ "$status" -eq 0 ]
+}